@@ -1,8 +1,8 @@
 import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from statsmodels.tsa.stattools import acf
 
+from src.utils.correlation_util import autocorrelation, estimate_period
 from src.utils.data_loader import init_standard_data
 from src.utils.data_loader_speed import init_speed_data
 from src.utils.project_constants import ProjectConstants
@@ -13,18 +13,22 @@ def plot_write_acf(plot_title, df, type, lags, n_lagperiods, periodicity, find_p
     fig = make_subplots(rows=len(df.groupby(["section"])), cols=1, y_title='Autocorrelation', x_title='Lags',
                         subplot_titles=ProjectConstants.VALID_EXPERIMENT_DAYS_WITH_PAUSES)
 
-    for idx, (section_name, group_df) in enumerate(df.groupby(["section"], sort=False), 1):
-        group_df = group_df.sort_index()
-        # Use statsmodels to calculate ACF
-        acf_values, confidence_intervals = acf(group_df[type], nlags=len(group_df[type]) - 1,
-                                               alpha=0.05)
-        lower_y = confidence_intervals[:, 0] - acf_values
-        upper_y = confidence_intervals[:, 1] - acf_values
+    sections = [(section_name, group_df.sort_index()) for section_name, group_df in
+                df.groupby(["section"], sort=False)]
+    # Only the plotted lags and the P1 search window are computed, for all sections in one batch
+    max_lag = max(lags * n_lagperiods, find_p1_max - 1)
+    all_acf_values, all_bands = autocorrelation([group_df[type] for _, group_df in sections], max_lag)
+    p1_maxima = estimate_period(all_acf_values, find_p1_min, find_p1_max)
+    for idx, (section_name, group_df) in enumerate(sections, 1):
+        is_computed = ~np.isnan(all_acf_values[idx - 1])
+        acf_values = all_acf_values[idx - 1][is_computed]
+        lower_y = -all_bands[idx - 1][is_computed]
+        upper_y = all_bands[idx - 1][is_computed]
         # Plot the autocorrelation
         fig.add_trace(
             go.Scatter(x=np.arange(len(acf_values)), y=acf_values, name=section_name), row=idx,
             col=1)
-        p1_max = np.argmax(acf_values[find_p1_min:find_p1_max]) + find_p1_min
+        p1_max = p1_maxima[idx - 1]
         # Plot the period of the autocorrelation
         fig.add_trace(
             go.Scatter(x=[0, p1_max], y=[acf_values[0], acf_values[p1_max]], marker_size=10, marker_color="red",
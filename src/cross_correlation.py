@@ -1,24 +1,23 @@
-import numpy as np
 import plotly.graph_objects as go
-from scipy.stats import norm
 
+from src.utils.correlation_util import confidence_line, cross_correlation
 from src.utils.data_loader import init_standard_data
 from src.utils.data_loader_speed import init_speed_data
 from src.utils.filter_util import reduce_two_dfs_to_common_index
 from src.utils.project_constants import ProjectConstants
+from src.utils.surrogates import surrogate_confidence_bands
 
 
-def make_cross_correlation(time_series_1, time_series_2, save_figure_with_file_name: str = None):
-    cross_corr = np.correlate(time_series_1 - np.mean(time_series_1),
-                              time_series_2 - np.mean(time_series_2),
-                              mode="full") / (
-                         np.std(time_series_1) * np.std(time_series_2) * len(time_series_1))
+def make_cross_correlation(time_series_1, time_series_2, save_figure_with_file_name: str = None, max_lag=6 * 24,
+                           n_surrogates=0, surrogate_method="iaaft", n_workers=1):
+    """
+    Plot the cross-correlation of the two series for the lags -max_lag..max_lag with the 95% significance lines
+    :param n_surrogates: Also plot the 95% bands of this many surrogates of the first series (see
+    surrogate_confidence_bands), which keep its autocorrelation unlike the white noise lines
+    """
+    lags, cross_corr = cross_correlation(time_series_1, time_series_2, max_lag=max_lag)
 
-    max_ts_length = len(time_series_1) + len(time_series_2) - 1
-    lags = np.arange(int(-(max_ts_length) / 2), int((max_ts_length + 1) / 2))
-
-    conf = 0.95  # confidence interval, qnorm((1 + ci)/2)/sqrt(x$n.used) formula used in stats:::plot.acf in ccf function
-    conf_interval = norm.ppf((1 + conf) / 2) / np.sqrt(len(time_series_1))  # 1.96 / sqrt(n) is the significance line!
+    conf_interval = confidence_line(len(time_series_1))  # 1.96 / sqrt(n) is the significance line!
     print(f"{conf_interval=}")
     assert len(lags) == len(cross_corr), f"Number of x and y values differ! {len(lags), len(cross_corr)}"
     fig = go.Figure()
@@ -35,6 +34,14 @@ def make_cross_correlation(time_series_1, time_series_2, save_figure_with_file_n
     fig.add_trace(go.Scatter(x=lags, y=[-conf_interval] * len(lags),
                              mode='lines', line=dict(dash='dash'), name='Lower Significance Line'))
 
+    if n_surrogates > 0:
+        bands = surrogate_confidence_bands(time_series_1, time_series_2, max_lag=max_lag, n_surrogates=n_surrogates,
+                                           method=surrogate_method, n_workers=n_workers)
+        fig.add_trace(go.Scatter(x=bands.index, y=bands["upper"], mode='lines', line=dict(dash='dot'),
+                                 name='Upper Surrogate Band'))
+        fig.add_trace(go.Scatter(x=bands.index, y=bands["lower"], mode='lines', line=dict(dash='dot'),
+                                 name='Lower Surrogate Band'))
+
     if save_figure_with_file_name:
         fig.update_layout(width=1200, height=400)
         fig.update_layout(go.Layout(margin=go.layout.Margin(l=65, r=5, b=60, t=25)))
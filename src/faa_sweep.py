@@ -0,0 +1,157 @@
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from statsmodels.stats.proportion import proportions_ztest
+
+from src.utils.data_loader import init_standard_data
+from src.utils.data_loader_speed import init_speed_data
+from src.utils.faa_detection import detect_faa
+from src.utils.feeding_times import FeedingSchedule
+from src.utils.project_constants import ProjectConstants
+from src.utils.resample_util import resample_mean
+
+# Inputs of the sweep, set once per process by _init_shared and only read by the settings
+_SHARED = {}
+
+
+def load_faa_inputs(resample_minutes=(10,)) -> dict:
+    """
+    Activity and speed as prepared in run_statistics_on_faa, loaded once and resampled once per grid
+    :return: Dict of minutes to the resampled activity and speed df
+    """
+    df_act = init_standard_data(include_random_phases=True)
+    df_act = df_act.reset_index()
+
+    df_speed = init_speed_data(include_random_phases=True)
+    formatting_data_start = pd.DataFrame({'speed': [np.nan]}, index=pd.to_datetime(['2023-06-02 00:00:00']))
+    formatting_data_end = pd.DataFrame({'speed': [np.nan]}, index=pd.to_datetime(['2023-07-12 23:50:00']))
+    df_speed = pd.concat([df_speed.copy(), formatting_data_start, formatting_data_end]).asfreq(freq='10min')
+    df_speed = df_speed.reset_index(names="Time (corrected)")
+    return {minutes: (resample_mean(df_act, minutes, ["activity"], on="Time (corrected)"),
+                      resample_mean(df_speed, minutes, ["speed"], on="Time (corrected)"))
+            for minutes in resample_minutes}
+
+
+def faa_first_last(faa_df: pd.DataFrame, feeding_starts: np.ndarray, feeding_ends: np.ndarray,
+                   cutoff_additional_hours=2, minutes=10):
+    """
+    First and last bin of FAA around every feeding as in run_statistics_on_faa: the start of the chain of FAA bins
+    (of the day of the feeding) that contains the bin before the feeding and the end of the chain from the end of the
+    cutoff on, or the bins next to them if they are no FAA
+    :param feeding_starts: Naive datetime64 starts of the feedings
+    :param minutes: Grid of the FAA windows, whose faa_end is the left edge of the last bin
+    :return: datetime64 arrays of the first and last bin (left edges) per feeding
+    """
+    step = np.timedelta64(minutes, "m").astype("timedelta64[ns]")
+    faa_starts = faa_df["faa_start"].to_numpy(dtype="datetime64[ns]")
+    counts = (faa_df["faa_end"].to_numpy(dtype="datetime64[ns]") - faa_starts) // step + 1
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    expanded = np.unique(np.repeat(faa_starts, counts) + offsets * step)
+    # Chains of consecutive bins, split at midnight
+    days = expanded.astype("datetime64[D]")
+    is_chain_start = np.concatenate([[True], (np.diff(expanded) != step) | (days[1:] != days[:-1])])[:len(expanded)]
+    chain_ids = np.cumsum(is_chain_start) - 1
+    chain_firsts = expanded[is_chain_start]
+    chain_lasts = expanded[np.concatenate([is_chain_start[1:], [True]])[:len(expanded)]]
+    feeding_days = feeding_starts.astype("datetime64[D]")
+
+    # Bins counted from midnight like the resampled grid, the bin before the feeding is rounded up to the grid
+    before = feeding_starts - step
+    before_day = before.astype("datetime64[D]")
+    before = before_day + -(-(before - before_day) // step) * step
+    after = feeding_ends + pd.Timedelta(hours=cutoff_additional_hours).to_timedelta64() + step
+    after_day = after.astype("datetime64[D]")
+    after = after_day + (after - after_day) // step * step
+    if len(expanded) == 0:
+        return before + step, after - step
+    results = []
+    for bins, chain_ends, outside in [(before, chain_firsts, before + step), (after, chain_lasts, after - step)]:
+        positions = np.minimum(np.searchsorted(expanded, bins), len(expanded) - 1)
+        is_faa = (expanded[positions] == bins) & (bins.astype("datetime64[D]") == feeding_days)
+        results.append(np.where(is_faa, chain_ends[chain_ids[positions]], outside))
+    return tuple(results)
+
+
+def _init_shared(series: dict, feeding_schedule: FeedingSchedule, feedings: tuple):
+    _SHARED.update(series=series, feeding_schedule=feeding_schedule, feedings=feedings)
+
+
+def _ztest(count_1: int, count_2: int, n: int):
+    if n == 0 or count_1 + count_2 == 0:
+        return np.nan, np.nan
+    return proportions_ztest([count_1, count_2], [n, n])
+
+
+def _sweep_setting(minutes, cutoff_additional_hours, duration_threshold_minutes, activity_quantile,
+                   speed_quantile) -> dict:
+    df_act, df_speed = _SHARED["series"][minutes]
+    feeding_starts, feeding_ends = _SHARED["feedings"]
+    results = {}
+    for name, df, data_type, quantile in [("act", df_act, "activity", activity_quantile),
+                                          ("speed", df_speed, "speed", speed_quantile)]:
+        faa_df = detect_faa(df[[data_type]], minutes, duration_threshold_minutes=duration_threshold_minutes,
+                            quantile=quantile, feeding_schedule=_SHARED["feeding_schedule"],
+                            cutoff_additional_hours=cutoff_additional_hours)
+        results[name] = faa_first_last(faa_df, feeding_starts, feeding_ends, cutoff_additional_hours, minutes)
+        results[f"n_faa_{name}"] = len(faa_df)
+    seq_length = len(feeding_starts)
+    row = {"resample_minutes": minutes, "cutoff_additional_hours": cutoff_additional_hours,
+           "duration_threshold_minutes": duration_threshold_minutes, "activity_quantile": activity_quantile,
+           "speed_quantile": speed_quantile, "n_feedings": seq_length, "n_faa_act": results["n_faa_act"],
+           "n_faa_speed": results["n_faa_speed"]}
+    for index, position, act_wins in [(0, "first", np.less), (1, "last", np.greater)]:
+        act, speed = results["act"][index], results["speed"][index]
+        act_count = int(act_wins(act, speed).sum())
+        speed_count = int(act_wins(speed, act).sum())
+        z_score, p_value = _ztest(act_count, speed_count, seq_length)
+        row.update({f"act_{position}": act_count, f"speed_{position}": speed_count,
+                    f"same_{position}": seq_length - act_count - speed_count,
+                    f"act_proportion_{position}": act_count / seq_length if seq_length else np.nan,
+                    f"speed_proportion_{position}": speed_count / seq_length if seq_length else np.nan,
+                    f"z_score_{position}": z_score, f"p_value_{position}": p_value})
+    return row
+
+
+def run_faa_sweep(cutoff_additional_hours=(0, 1, 2), duration_threshold_minutes=(60, 120), activity_quantiles=(0.5,),
+                  speed_quantiles=(0.2,), resample_minutes=(10,), n_workers=1, save=True) -> pd.DataFrame:
+    """
+    STATS 3 of run_statistics_on_faa for every combination of the settings: which of activity and speed FAA starts
+    first before and ends last after the feedings, with the two-proportion z-tests. The data is loaded and resampled
+    once and handed to every worker process once.
+    :param n_workers: Number of processes for the settings, 1 computes them serially
+    :return: df with one row per setting, also written to faa_sweep.csv in the statistics folder
+    """
+    series = load_faa_inputs(resample_minutes)
+    feedings = FeedingSchedule.load().events()
+    feedings = feedings.loc[feedings["section"].isin(ProjectConstants.FEEDING_PHASES)]
+    feedings = (feedings["start"].to_numpy(dtype="datetime64[ns]"), feedings["end"].to_numpy(dtype="datetime64[ns]"))
+    for values in feedings:
+        values.setflags(write=False)
+    shared = (series, FeedingSchedule.load(with_breaks=True).fill_days_without_feeding(), feedings)
+    settings = list(itertools.product(resample_minutes, cutoff_additional_hours, duration_threshold_minutes,
+                                      activity_quantiles, speed_quantiles))
+    start = time.perf_counter()
+    if n_workers is None or n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_shared, initargs=shared) as executor:
+            rows = list(executor.map(_sweep_setting, *zip(*settings), chunksize=max(len(settings) // 32, 1)))
+    else:
+        _init_shared(*shared)
+        rows = [_sweep_setting(*setting) for setting in settings]
+    print(f"{len(settings)} FAA settings in {time.perf_counter() - start:.1f}s")
+    sweep_df = pd.DataFrame(rows)
+    if save:
+        sweep_df.to_csv(ProjectConstants.STATISTICS.joinpath("faa_sweep").with_suffix(".csv").as_posix(), index=False)
+    return sweep_df
+
+
+if __name__ == "__main__":
+    sweep_df = run_faa_sweep(cutoff_additional_hours=(0, 1, 2, 3), duration_threshold_minutes=(40, 60, 90, 120),
+                             activity_quantiles=(0.4, 0.5, 0.6), speed_quantiles=(0.1, 0.2, 0.3),
+                             resample_minutes=(10, 20), n_workers=None)
+    is_act_first = (sweep_df["p_value_first"] < 0.05) & (sweep_df["act_first"] > sweep_df["speed_first"])
+    is_speed_last = (sweep_df["p_value_last"] < 0.05) & (sweep_df["speed_last"] > sweep_df["act_last"])
+    print(f"'act' significantly more often first in {is_act_first.mean():.0%} and 'speed' significantly more often "
+          f"last in {is_speed_last.mean():.0%} of the settings")
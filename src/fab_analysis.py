@@ -5,88 +5,37 @@ from plotly.subplots import make_subplots
 
 from src.utils.data_loader import init_standard_data
 from src.utils.data_loader_speed import init_speed_data
-from src.utils.feeding_times import add_feeding_bars_discrete, load_feeding_times
+from src.utils.faa_detection import detect_faa
+from src.utils.feeding_times import FeedingSchedule, add_feeding_bars_discrete
 from src.utils.filter_util import get_start_and_end_from_df_act
 from src.utils.project_constants import ProjectConstants
+from src.utils.resample_util import resample_mean
 
 
 def identify_lasting_peaks(df, minutes: int = 20, duration_threshold_minutes=120, quantile=0.5,
                            data_type="activity", cutoff_additional_hours=2,
                            only_untiL_feeding=False):
-    df = df.resample(f"{minutes}min", label="left", closed="left",
-                     offset=f"{0}min",
-                     on="Time (corrected)").mean()
-    df["time"] = df.index
-    # choosing the quantile as threshold for FAA
-    quantile = quantile
-    faa_duration = int(duration_threshold_minutes / minutes)
-    list_of_faa_time = []
-    total_activations = 0
-    # Adding ghost feeding times
-    feeding_times = load_feeding_times(with_breaks=True)
+    """
+    FAA windows of the group per day (see detect_faa): at least duration_threshold_minutes at or above the quantile
+    of the day. With only_untiL_feeding the windows end at the feedings plus cutoff_additional_hours, the days
+    without feeding use the feeding times of the last day with feeding (ghost feeding times).
+    :return: One list of {"faa_start": .., "faa_end": ..} per day of the data
+    """
+    df = resample_mean(df, minutes, [data_type], on="Time (corrected)")
+    feeding_schedule = None
     if only_untiL_feeding:
-        previous_non_empty_list = None
-        for index, row in feeding_times.iterrows():
-            if row["feeding_times"] == []:
-                if previous_non_empty_list is not None:
-                    row["feeding_times"] = previous_non_empty_list
-            else:
-                previous_non_empty_list = row["feeding_times"]
-        print(feeding_times)
-    for datum, mini_df in df.groupby(df["time"].dt.date):
-        mini_df["time"] = pd.to_datetime(df["time"]).dt.tz_localize(None)
-        faa_threshold = mini_df[data_type].quantile(quantile)
-        # resample the data, since we only interested in the group behaviour
-        # setting faa duration to 6 which equals 20 minutes * 6 = 120 minutes
-        # This is how long a peak must persist to be considered true FAA (since 120 minutes is the feeding window)
-        print(f"{faa_threshold=} and {duration_threshold_minutes=}")
-        if only_untiL_feeding:
-            # Remove the feeding times
-            cutoff_time = feeding_times.loc[feeding_times["date"] == datum, "feeding_times"]
-            # Getting the starting time of all feedings of that day
-            cutoff_time_start_list = [cutoff_time.values[0][i][0] for i in range(len(cutoff_time.values[0]))]
-            cutoff_time_end_list = [cutoff_time.values[0][i][1] for i in range(len(cutoff_time.values[0]))]
-            cutoff_time_start_dt_list = [
-                pd.to_datetime(datum.strftime("%Y-%m-%d") + " " + pd.to_datetime(el).time().strftime("%H:%M:%S")) for el
-                in cutoff_time_start_list]
-            fab_cutoff_time_end_dt_list = [
-                pd.to_datetime(datum.strftime("%Y-%m-%d") + " " + pd.to_datetime(el).time().strftime("%H:%M:%S")) for el
-                in
-                cutoff_time_end_list]
-            cutoff_time_start_dt_list = [el.tz_localize(None) for el in cutoff_time_start_dt_list]
-            fab_cutoff_time_end_dt_list = [el.tz_localize(None) for el in fab_cutoff_time_end_dt_list]
-            for (cutoff_start, cutoff_end) in zip(cutoff_time_start_dt_list, fab_cutoff_time_end_dt_list):
-                cutoff_end = cutoff_end + pd.DateOffset(hours=cutoff_additional_hours)
-                # Negation filtering here
-                to_drop_df = mini_df.between_time(start_time=cutoff_start.time(), end_time=cutoff_end.time(),
-                                                  include_end=False, include_start=True)
-                mini_df = mini_df.drop(to_drop_df.index)
-
-            mini_df = mini_df.asfreq("10min")
-            na = mini_df[data_type].isna().cumsum()
-            for i, d in mini_df.loc[na.eq(0) | na.duplicated()].groupby(na):
-                print(d)
-            # Number each value from the beginning starting with 1, but keep the number if over threshold
-
-            grouper = mini_df.loc[na.eq(0) | na.duplicated()].groupby(
-                [na, mini_df[data_type].ge(faa_threshold).diff().ne(0).cumsum()])
-        else:
-            grouper = mini_df.groupby(mini_df[data_type].ge(faa_threshold).diff().ne(0).cumsum())
-
-        # The smallest in the group MUST be higher than the threshold
-        # The diff between the first and last element in the group must exceed the set faa_duration
-        result = []
-        print(f"{faa_duration=}")
-        for group_key, group in grouper:
-            if group[data_type].min() >= faa_threshold:
-                if len(group) >= faa_duration:
-                    result.append(group)
-        print(f"Number of FAA windows ({data_type}) detected for the f{datum}: {len(result)}")
-        result_without_index = [df.reset_index(drop=True) for df in result]
-        list_of_faa_time.append([{"faa_start": el["time"].iloc[0],
-                                  "faa_end": el["time"].iloc[-1]} for el in result_without_index])
-        total_activations += len(result)
-    print(f"TOTAL: Number of FAA windows ({data_type}) detected: {total_activations}")
+        feeding_schedule = FeedingSchedule.load(with_breaks=True).fill_days_without_feeding()
+    faa_df = detect_faa(df[[data_type]], minutes, duration_threshold_minutes=duration_threshold_minutes,
+                        quantile=quantile, feeding_schedule=feeding_schedule,
+                        cutoff_additional_hours=cutoff_additional_hours)
+    faa_by_day = {datum: day_df for datum, day_df in faa_df.groupby("date")}
+    list_of_faa_time = []
+    for datum in pd.unique(pd.Series(df.index).dt.date):
+        faa_of_the_day = faa_by_day.get(datum, faa_df.iloc[:0])
+        print(f"Number of FAA windows ({data_type}) detected for the f{datum}: {len(faa_of_the_day)}")
+        list_of_faa_time.append([{"faa_start": faa_start, "faa_end": faa_end} for faa_start, faa_end in
+                                 zip(faa_of_the_day["faa_start"], faa_of_the_day["faa_end"])])
+    print(f"TOTAL: Number of FAA windows ({data_type}) detected: {len(faa_df)}")
     return list_of_faa_time
 
 
@@ -1,9 +1,10 @@
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
 from src.utils.data_loader import init_standard_data
-from src.utils.feeding_times import load_feeding_times
+from src.utils.feeding_times import FeedingSchedule
 from src.utils.project_constants import ProjectConstants
 
 
@@ -14,28 +15,27 @@ def create_feeding_graph():
 
     start = df["date"].min()
     end = df["date"].max()
-    feeding_times = load_feeding_times()
-    feeding_times = feeding_times[feeding_times["date"].between(start, end)]
-    feeding_times = feeding_times.explode("feeding_times")
-    feeding_times["feeding_n"] = feeding_times.groupby("date").cumcount() + 1
-    feeding_times = feeding_times.explode("feeding_times")
-    feeding_times["feeding_times"] = pd.to_datetime(feeding_times["feeding_times"])
+    schedule = FeedingSchedule.load()
+    days = schedule.days[(schedule.days >= pd.Timestamp(start)) & (schedule.days <= pd.Timestamp(end))]
+    feedings = schedule.events(days[0], days[-1] + pd.Timedelta(days=1))
+    # The feeding times are drawn on the axis of the current day
+    today = pd.Timestamp.today().normalize()
     fig = go.Figure()
     red_color = px.colors.qualitative.D3[3]
     green_color = px.colors.qualitative.D3[2]
     colours = [green_color] * 16 + [red_color] * 4 + [green_color] * 15 + [red_color] + [green_color] * 7
-    for idx, (_, feeding_group) in enumerate(feeding_times.groupby(["date"])):
-        color = colours[idx]
-        for _, feeding_n in feeding_group.groupby(["feeding_n"]):
-            fig.add_trace(
-                go.Scatter(
-                    mode='markers+lines',
-                    x=feeding_n['feeding_times'],
-                    y=feeding_n['date'],
-                    marker=dict(color=color),
-                    showlegend=False
-                ),
-            )
+    for day, feeding_start, feeding_end in zip(feedings["date"], feedings["start"], feedings["end"]):
+        # One colour per day, days without feeding included
+        color = colours[np.searchsorted(days, day.to_datetime64())]
+        fig.add_trace(
+            go.Scatter(
+                mode='markers+lines',
+                x=[today + (feeding_start - day), today + (feeding_end - day)],
+                y=[day.date(), day.date()],
+                marker=dict(color=color),
+                showlegend=False
+            ),
+        )
     fig.add_trace(
         go.Scatter(x=[None], y=[None], name="Normal Feeding", marker=dict(color=green_color), legendgroup="Feeding",
                    legendgrouptitle_text="Feeding Mode"))
@@ -2,76 +2,107 @@ import warnings
 
 from plotly.subplots import make_subplots
 
-from src.utils.data_loader import init_standard_data
+from src.utils.data_loader import init_standard_data_for_types
 from src.utils.data_loader_speed import init_speed_data
-from src.utils.feeding_times import load_feeding_times
+from src.utils.feeding_times import FeedingSchedule
 from src.utils.filter_util import filter_by_valid_days
+from src.utils.event_windows import locate_windows, window_mean_sem, window_positions
 from src.utils.project_constants import ProjectConstants
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import time
 
 
+def _feeding_windows(df, schedule: FeedingSchedule, interval_before, interval_after,
+                     fixed_twilight=False) -> pd.DataFrame:
+    """All feeding windows of the feeding phases, in the order of the experiment sections in df and the feedings"""
+    feedings = schedule.events()
+    feedings = feedings.loc[feedings["section"].isin(ProjectConstants.FEEDING_PHASES)]
+    windows = []
+    feeding_event_1 = feeding_event_2 = None
+    for experiment_section in sorted(df["experiment_section"].dropna().unique()):
+        section_feedings = feedings.loc[feedings["section"] == experiment_section]
+        for date, start, end, feeding_of_the_day in zip(section_feedings["date"], section_feedings["start"],
+                                                        section_feedings["end"],
+                                                        section_feedings["feeding_of_the_day"]):
+            feeding_event = (start.strftime("%H:%M:%S"), end.strftime("%H:%M:%S"))
+            if fixed_twilight and experiment_section == "Twilight Feeding":
+                if feeding_of_the_day == 1:
+                    feeding_event_1 = "06:33:00"
+                    feeding_event_2 = "06:48:00"
+                elif feeding_of_the_day == 2:
+                    feeding_event_1 = "20:25:00"
+                    feeding_event_2 = "20:40:00"
+            else:
+                feeding_event_1 = feeding_event[0]
+                feeding_event_2 = feeding_event[1]
+            windows.append((experiment_section, feeding_event[0], str(feeding_of_the_day), date, feeding_event_1,
+                            feeding_event_2))
+    windows = pd.DataFrame(windows, columns=["experiment_section", "feeding_start", "feeding_of_the_day", "date",
+                                             "event_start", "event_end"])
+    windows["start_interval"] = windows["date"] + pd.to_timedelta(windows["event_start"]) - interval_before
+    windows["end_interval"] = windows["date"] + pd.to_timedelta(windows["event_end"]) + interval_after
+    return windows
+
+
 def mean_around_feeding(df, hours_prior, hours_after, type="activity", calc_mean=True, fixed_twilight=False):
-    """Cuts the df into the time around feeding and averaging results if wished."""
-    feeding_times = load_feeding_times()
-    feeding_times["datum"] = feeding_times["date"]
-    feeding_times = filter_by_valid_days(feeding_times)
+    """
+    Cuts the df into the time around feeding and averaging results if wished.
+    All windows are located at once by searchsorted on the sorted times of each experiment section.
+    """
+    schedule = FeedingSchedule.load()
     interval_before = pd.Timedelta(hours=hours_prior)
     interval_after = pd.Timedelta(hours=hours_after)
+    windows = _feeding_windows(df, schedule, interval_before, interval_after, fixed_twilight)
+
+    # Rows of every window, searched within the rows of its experiment section
+    lower = np.zeros(len(windows), dtype=np.int64)
+    upper = np.zeros(len(windows), dtype=np.int64)
+    section_rows = {}
+    for experiment_section, rows in df.groupby("experiment_section").indices.items():
+        is_section = (windows["experiment_section"] == experiment_section).to_numpy()
+        order, lower[is_section], upper[is_section] = locate_windows(df["datum"].iloc[rows],
+                                                                     windows.loc[is_section, "start_interval"],
+                                                                     windows.loc[is_section, "end_interval"])
+        section_rows[experiment_section] = rows[order]
+    offsets = np.cumsum([0] + [len(rows) for rows in section_rows.values()])
+    section_offsets = dict(zip(section_rows.keys(), offsets[:-1]))
+    window_offsets = windows["experiment_section"].map(section_offsets).to_numpy(dtype=np.int64)
+    order = np.concatenate(list(section_rows.values())) if section_rows else np.array([], dtype=np.int64)
+    lower += window_offsets
+    upper += window_offsets
+    is_filled = upper > lower
+
+    # Empty windows add the columns of df to the result (as appending the empty selection did)
+    empty_columns = list(df.columns) + ["feeding_of_the_day", "start_interval", "end_interval"]
     if calc_mean:
-        mean_df = pd.DataFrame(
-            columns=["start_interval", "end_interval", "mean_for_feeding_period", "SE_for_feeding_period"])
+        mean, sem = window_mean_sem(df[type].to_numpy(), order, lower, upper)
+        filled = windows.loc[is_filled]
+        mean_df = pd.DataFrame({"start_interval": filled["start_interval"].to_numpy(),
+                                "end_interval": filled["end_interval"].to_numpy(),
+                                "mean_for_feeding_period": mean[is_filled],
+                                "SE_for_feeding_period": sem[is_filled],
+                                "experiment_section": filled["experiment_section"].to_numpy(),
+                                "feeding_start": filled["feeding_start"].to_numpy(),
+                                "feeding_of_the_day": filled["feeding_of_the_day"].to_numpy()})
+        columns = ["start_interval", "end_interval", "mean_for_feeding_period", "SE_for_feeding_period"]
+        for window_is_filled in is_filled:
+            new_columns = ["experiment_section", "feeding_start", "feeding_of_the_day"] if window_is_filled else \
+                empty_columns
+            columns += [column for column in new_columns if column not in columns]
+        pieces = [mean_df] if is_filled.all() else [mean_df, df.iloc[:0].assign(
+            feeding_of_the_day="", start_interval=pd.NaT, end_interval=pd.NaT)]
+        mean_df = pd.concat(pieces).reindex(columns=columns)
     else:
-        mean_df = pd.DataFrame(columns=df.columns)
-    for experiment_section, fish_df in df.groupby(["experiment_section"]):
-        for date in feeding_times.loc[feeding_times["experiment_section"] == experiment_section, "date"]:
-            for feeding_events_of_the_day in feeding_times.loc[feeding_times["date"] == date, "feeding_times"]:
-                for feeding_idx, feeding_event in enumerate(feeding_events_of_the_day):
-                    if fixed_twilight and experiment_section == "Twilight Feeding":
-                        if feeding_idx == 0:
-                            feeding_event_1 = "06:33:00"
-                            feeding_event_2 = "06:48:00"
-                        elif feeding_idx == 1:
-                            feeding_event_1 = "20:25:00"
-                            feeding_event_2 = "20:40:00"
-                    else:
-                        feeding_event_1 = feeding_event[0]
-                        feeding_event_2 = feeding_event[1]
-
-                    feeding_start_time = pd.to_datetime(date) + pd.to_timedelta(feeding_event_1)
-                    feeding_end_time = pd.to_datetime(date) + pd.to_timedelta(feeding_event_2)
-
-                    interval_start = feeding_start_time - interval_before
-                    interval_end = feeding_end_time + interval_after
-                    try:
-                        df_short_activity = fish_df[
-                            (fish_df["datum"]) < pd.Timestamp(interval_end, tz="UTC")]
-                        df_short_activity = df_short_activity[
-                            df_short_activity["datum"] >= pd.Timestamp(interval_start, tz="UTC")]
-                    except TypeError as e:
-                        df_short_activity = fish_df[
-                            (fish_df["datum"]) < pd.Timestamp(interval_end)]
-                        df_short_activity = df_short_activity[
-                            df_short_activity["datum"] >= pd.Timestamp(interval_start)]
-                    if len(df_short_activity) > 0 and calc_mean:
-                        activity_mean_for_feeding_period = df_short_activity[type].mean()
-                        activity_SE_for_feeding_period = df_short_activity[type].sem()
-                        mean_df = mean_df.append({"experiment_section": experiment_section,
-                                                  "feeding_start": feeding_event[0],
-                                                  "start_interval": interval_start,
-                                                  "end_interval": interval_end,
-                                                  "mean_for_feeding_period": activity_mean_for_feeding_period,
-                                                  "SE_for_feeding_period": activity_SE_for_feeding_period,
-                                                  "feeding_of_the_day": str(int(feeding_idx + 1))},
-                                                 ignore_index=True)
-                    else:
-                        df_short_activity["feeding_of_the_day"] = str(int(feeding_idx + 1))
-                        df_short_activity["start_interval"] = interval_start
-                        df_short_activity["end_interval"] = interval_end
-                        mean_df = mean_df.append(df_short_activity)
+        positions, window_ids = window_positions(order, lower, upper)
+        mean_df = df.iloc[positions].copy()
+        mean_df["feeding_of_the_day"] = windows["feeding_of_the_day"].to_numpy()[window_ids]
+        mean_df["start_interval"] = windows["start_interval"].to_numpy()[window_ids]
+        mean_df["end_interval"] = windows["end_interval"].to_numpy()[window_ids]
+        mean_df = pd.concat([pd.DataFrame(columns=df.columns), mean_df])
     mean_df["type"] = type
     if calc_mean:
         return mean_df.sort_values("start_interval")
@@ -81,9 +112,9 @@ def mean_around_feeding(df, hours_prior, hours_after, type="activity", calc_mean
 
 def plot_means_around_feeding_with_all():
     """Plots Figure 8"""
-    df_act = init_standard_data()
-
-    df_depth = init_standard_data(data_type="Depth [m] (est. or from tag)")
+    dfs = init_standard_data_for_types(["activity", "Depth [m] (est. or from tag)"])
+    df_act = dfs["activity"]
+    df_depth = dfs["Depth [m] (est. or from tag)"]
 
     df_speed = init_speed_data()
 
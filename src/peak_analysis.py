@@ -7,28 +7,47 @@ from src.utils.data_loader import init_standard_data
 from src.utils.data_loader_speed import init_speed_data
 from src.utils.feeding_times import add_feeding_bars_discrete
 from src.utils.filter_util import get_start_and_end_from_df_act
-from src.utils.persistent_homology import get_persistent_homology
+from src.utils.persistence_index import PersistenceIndex
+from src.utils.persistent_homology import get_segmented_persistent_homology, top_k_per_segment
 from src.utils.project_constants import ProjectConstants
+from src.utils.resample_util import resample_statistics
 
 
-def calculate_persistence(df, number_of_peaks_for_comparison, threshold, type="activity"):
+def calculate_persistence(df, number_of_peaks_for_comparison, threshold, type="activity", segment_by_day=False):
+    """
+    Persistent peaks of the series with their rank within the day, keeping the most persistent ones per day.
+    For many thresholds or numbers of peaks on the same series use a PersistenceIndex directly.
+    :param segment_by_day: Compute the persistence within every day instead of over the whole series
+    """
     # Here is where we actually compute the persistence
-    peaks_df = get_persistent_homology(df[type])
-    peaks_df[type] = peaks_df["value"]
-    peaks_df = peaks_df.loc[peaks_df["persistence"] > threshold]
-    datetimes = df[[type]].reset_index().iloc[peaks_df["born"], 0]
-    peaks_df["Time (corrected)"] = pd.to_datetime(datetimes.values)
-    peaks_df = peaks_df.set_index(peaks_df["Time (corrected)"])
-    peaks_df['rank_within_day'] = (
-        peaks_df.groupby(peaks_df.index.date)['persistence']
-        .transform(lambda x: x.rank(ascending=False, method='first'))
-    ).astype(int).astype(str)
+    persistence_index = PersistenceIndex.from_series(df[type], segment_by_day=segment_by_day)
     # Get the highest n rows by persistence
-    peaks_df = peaks_df.loc[
-        peaks_df.groupby(peaks_df.index.date)["persistence"].nlargest(
-            number_of_peaks_for_comparison).reset_index(
-            level=0, drop=True).index]
-    return peaks_df
+    return persistence_index.query(threshold=threshold, top_n=number_of_peaks_for_comparison)
+
+
+def calculate_persistence_per_fish(df, number_of_peaks_for_comparison, type="activity", minutes=10):
+    """
+    The most persistent peaks per fish and day, with the persistence computed within every fish and day
+    :param df: Cleaned detections, e.g. from load_standard_detections
+    :return: df of the peaks with fish_name, date, rank, value and persistence
+    """
+    if type == "activity":
+        df = df.loc[df["is_activity"]]
+    elif type == "temperature":
+        df = df.loc[df["is_temperature"]]
+    on = "Time (corrected)" if "Time (corrected)" in df.columns else None
+    series = resample_statistics(df, minutes, [type], on=on, by="fish_name")[(type, "mean")].dropna()
+    fish_names = series.index.get_level_values(0)
+    times = series.index.get_level_values(1)
+    segments = pd.MultiIndex.from_arrays([fish_names, times.normalize()])
+    peaks_df = top_k_per_segment(get_segmented_persistent_homology(series, segments),
+                                 number_of_peaks_for_comparison)
+    peaks_df = peaks_df.drop(columns=["segment"])
+    peaks_df.insert(0, "fish_name", fish_names[peaks_df["born"]])
+    peaks_df.insert(1, "date", times[peaks_df["born"]].date)
+    peaks_df["Time (corrected)"] = times[peaks_df["born"]]
+    peaks_df[type] = peaks_df["value"]
+    return peaks_df.reset_index(drop=True)
 
 
 def add_peaks_to_fig_subplot(fig, peak_df, n: int, marker_size: int = 7, type_value="activity"):
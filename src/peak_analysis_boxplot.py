@@ -5,46 +5,21 @@ import plotly.graph_objects as go
 from src.peak_analysis import calculate_persistence
 from src.utils.data_loader import init_standard_data
 from src.utils.data_loader_speed import init_speed_data
-from src.utils.feeding_times import load_feeding_times
-from src.utils.filter_util import assign_experiment_section
+from src.utils.feeding_times import FeedingSchedule
+from src.utils.filter_util import assign_sections
 from src.utils.project_constants import ProjectConstants
 
 
 def plot_rank_diff_against_feeding_time(peaks_df):
-    feeding_times = load_feeding_times(with_breaks=False)
-    feeding_times["datum"] = feeding_times["date"]
-    feeding_times = feeding_times.explode("feeding_times")
-    feeding_times[["start", "end"]] = feeding_times["feeding_times"].apply(pd.Series)
-    feeding_times["time_start"] = pd.to_datetime(
-        feeding_times["date"].astype(str) + " " + feeding_times["start"])
-    feeding_times["time_end"] = pd.to_datetime(
-        feeding_times["date"].astype(str) + " " + feeding_times["end"])
-
+    schedule = FeedingSchedule.load(with_breaks=False)
     peaks_df = peaks_df.reset_index(drop=True)
     peaks_df = peaks_df.drop(columns=["born", "left", "right", "died"])
-    feeding_times = feeding_times.drop(columns=["datum", "start", "end", "feeding_times"])
-
-    peaks_df = peaks_df.sort_values("Time (corrected)")
-    feeding_times = feeding_times.sort_values("time_start")
-
-    merged_start_df = pd.merge_asof(peaks_df, feeding_times, left_on="Time (corrected)", right_on="time_start",
-                                    direction='nearest')
-
-    feeding_times = feeding_times.sort_values("time_end")
-    merge_end_df = pd.merge_asof(peaks_df, feeding_times, left_on="Time (corrected)", right_on="time_end",
-                                 direction='nearest')
-    assert merged_start_df["Time (corrected)"].equals(
-        merge_end_df["Time (corrected)"]), "The merge will give wrong results!"
-    # Calculate distance between the feeding and the persistent peak
-    distance_start = (merged_start_df["Time (corrected)"] - merged_start_df["time_start"]).dt.total_seconds()
-    distance_end = (merge_end_df["Time (corrected)"] - merge_end_df["time_end"]).dt.total_seconds()
-    merged_start_df['time_difference'] = distance_start.where(distance_start.abs() < distance_end.abs(),
-                                                              distance_end)
-    # If calculated time is in feeding time, set value to 0
-    merged_start_df.loc[(merged_start_df["Time (corrected)"] >= merged_start_df["time_start"]) & (
-            merged_start_df["Time (corrected)"] <= merged_start_df["time_end"]), 'time_difference'] = 0
+    peaks_df = peaks_df.sort_values("Time (corrected)").reset_index(drop=True)
+    # Calculate distance between the feeding and the persistent peak, 0 if the peak is in the feeding time
+    time_difference = schedule.time_to_feeding(peaks_df["Time (corrected)"])
+    peaks_df['time_difference'] = pd.to_timedelta(time_difference).total_seconds()
 
-    time_df = merged_start_df[["Time (corrected)", "time_difference", "rank_within_day"]]
+    time_df = peaks_df[["Time (corrected)", "time_difference", "rank_within_day"]]
     # Translate time from seconds back to hours
     time_df['time_difference_hours'] = time_df['time_difference'] / 3600
 
@@ -60,9 +35,9 @@ def plot_both_act_speed_time_diffs_in_one_boxplot(include_irregular_phases=False
     peaks_df_speed = calculate_persistence(df_speed.copy(), 3, 0, type="speed")
     # Calculate time diff between feeding and persistent peaks
     time_df_act = plot_rank_diff_against_feeding_time(peaks_df_act.copy())
-    time_df_act['section'] = time_df_act.apply(assign_experiment_section, axis=1)
+    time_df_act['section'] = assign_sections(time_df_act["date"])
     time_df_speed = plot_rank_diff_against_feeding_time(peaks_df_speed.copy())
-    time_df_speed['section'] = time_df_speed.apply(assign_experiment_section, axis=1)
+    time_df_speed['section'] = assign_sections(time_df_speed["date"])
     time_df_act["type"] = "Activity"
     time_df_speed["type"] = "Speed"
     df = pd.concat([time_df_act, time_df_speed], ignore_index=True)
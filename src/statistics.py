@@ -1,6 +1,4 @@
 import time
-from datetime import datetime
-from datetime import time as time_stuff
 
 import numpy as np
 import pandas as pd
@@ -13,18 +11,20 @@ from src.fab_analysis import identify_lasting_peaks
 from src.mean_around_feeding import mean_around_feeding
 from src.peak_analysis import calculate_persistence
 from src.peak_analysis_boxplot import plot_rank_diff_against_feeding_time
-from src.utils.data_loader import init_standard_data
+from src.utils.data_loader import init_standard_data, init_standard_data_for_types
 from src.utils.data_loader_speed import init_speed_data, zero_interpolation_of_speed_data, \
     spline_interpolation_of_speed_data
-from src.utils.feeding_times import load_feeding_times
-from src.utils.filter_util import assign_experiment_section, filter_by_valid_days
+from src.utils.feeding_times import FeedingSchedule
+from src.utils.filter_util import assign_sections, filter_by_valid_days
 from src.utils.project_constants import ProjectConstants
 
 
 def run_stationarity_test():
-    df_act = init_standard_data(include_random_phases=True)
-    df_depth = init_standard_data(include_random_phases=True, data_type="Depth [m] (est. or from tag)")
-    df_temp = init_standard_data(include_random_phases=True, data_type="temperature")
+    dfs = init_standard_data_for_types(["activity", "Depth [m] (est. or from tag)", "temperature"],
+                                       include_random_phases=True)
+    df_act = dfs["activity"]
+    df_depth = dfs["Depth [m] (est. or from tag)"]
+    df_temp = dfs["temperature"]
     df_speed = init_speed_data(include_random_phases=True)
     # STATS 1: activity, depth and speed are stationary, temperature is not stationary!
 
@@ -74,9 +74,9 @@ def run_statistics_peaks_act_and_speed():
     peaks_df_speed = calculate_persistence(df_speed.copy(), 3, 0, type="speed")
     # Calculate time diff between feeding and persistent peaks
     time_df_act = plot_rank_diff_against_feeding_time(peaks_df_act.copy())
-    time_df_act['section'] = time_df_act.apply(assign_experiment_section, axis=1)
+    time_df_act['section'] = assign_sections(time_df_act["date"])
     time_df_speed = plot_rank_diff_against_feeding_time(peaks_df_speed.copy())
-    time_df_speed['section'] = time_df_speed.apply(assign_experiment_section, axis=1)
+    time_df_speed['section'] = assign_sections(time_df_speed["date"])
     time_df_act["type"] = "activity"
     time_df_speed["type"] = "speed"
     df = pd.concat([time_df_act, time_df_speed], ignore_index=True)
@@ -141,6 +141,7 @@ def feeding_list_to_expanded_df(faa_list):
 def run_statistics_on_faa(cutoff_additional_hours=2, duration_threshold_minutes=60):
     # STATS 3 cutoff_additional_hours = 0,1,2 and duration_threshold_minutes=60, 120
     # makes no difference, still same significant result
+    # run_faa_sweep in faa_sweep.py runs all combinations (and quantiles, resample minutes) at once
     df_act = init_standard_data(include_random_phases=True)
     df_act = df_act.reset_index()
 
@@ -163,68 +164,65 @@ def run_statistics_on_faa(cutoff_additional_hours=2, duration_threshold_minutes=
     faa_act_expanded = feeding_list_to_expanded_df(faa_list_act_feeding)
     faa_speed_expanded = feeding_list_to_expanded_df(faa_list_speed_feeding)
     print("######## Statistics with all phases ########")
-    feeding_times = load_feeding_times()
-    feeding_times["datum"] = feeding_times["date"]
-    feeding_times = filter_by_valid_days(feeding_times)
+    feedings = FeedingSchedule.load().events()
+    feedings = feedings.loc[feedings["section"].isin(ProjectConstants.FEEDING_PHASES)]
     first_last_act_speed_df = pd.DataFrame(
         columns=["date", "feeding_event", "who_first", "value_first", "who_last", "value_last"])
-    for date, feedings in feeding_times.groupby(["date"]):
-        for feeding_events in feedings["feeding_times"]:
-            for feeding_event in feeding_events:
-                feeding_start = datetime.combine(date, time_stuff.fromisoformat(feeding_event[0]))
-                feeding_end = datetime.combine(date, time_stuff.fromisoformat(feeding_event[1]))
-                faa_act_of_the_day = faa_act_expanded.loc[faa_act_expanded["Time (corrected)"].dt.date == date]
-                faa_speed_of_the_day = faa_speed_expanded.loc[faa_speed_expanded["Time (corrected)"].dt.date == date]
-
-                prev_timestamp = feeding_start - pd.Timedelta(minutes=10)
-                minutes_to_add = (10 - prev_timestamp.minute % 10) if prev_timestamp.minute % 10 != 0 else 0
-                prev_timestamp = prev_timestamp + pd.Timedelta(minutes=minutes_to_add)
-                while faa_act_of_the_day['Time (corrected)'].isin([prev_timestamp]).any():
-                    prev_timestamp -= pd.Timedelta(minutes=10)
-                act_first = prev_timestamp + pd.Timedelta(minutes=10)
-
-                prev_timestamp = feeding_start - pd.Timedelta(minutes=10)
-                minutes_to_add = (10 - prev_timestamp.minute % 10) if prev_timestamp.minute % 10 != 0 else 0
-                prev_timestamp = prev_timestamp + pd.Timedelta(minutes=minutes_to_add)
-                while faa_speed_of_the_day['Time (corrected)'].isin([prev_timestamp]).any():
-                    prev_timestamp -= pd.Timedelta(minutes=10)
-                speed_first = prev_timestamp + pd.Timedelta(minutes=10)
-
-                if act_first < speed_first:
-                    value_first = act_first
-                    who_first = "act"
-                elif act_first > speed_first:
-                    value_first = speed_first
-                    who_first = "speed"
-                else:
-                    value_first = act_first  # or speed_first
-                    who_first = "same"
-
-                prev_timestamp = feeding_end + pd.Timedelta(hours=cutoff_additional_hours) + pd.Timedelta(minutes=10)
-                prev_timestamp = prev_timestamp - pd.Timedelta(minutes=prev_timestamp.minute % 10)
-                while faa_act_of_the_day['Time (corrected)'].isin([prev_timestamp]).any():
-                    prev_timestamp += pd.Timedelta(minutes=10)
-                act_last = prev_timestamp - pd.Timedelta(minutes=10)
-
-                prev_timestamp = feeding_end + pd.Timedelta(hours=cutoff_additional_hours) + pd.Timedelta(minutes=10)
-                prev_timestamp = prev_timestamp - pd.Timedelta(minutes=prev_timestamp.minute % 10)
-                while faa_speed_of_the_day['Time (corrected)'].isin([prev_timestamp]).any():
-                    prev_timestamp += pd.Timedelta(minutes=10)
-                speed_last = prev_timestamp - pd.Timedelta(minutes=10)
-
-                if act_last > speed_last:
-                    value_last = act_last
-                    who_last = "act"
-                elif act_last < speed_last:
-                    value_last = speed_last
-                    who_last = "speed"
-                else:
-                    value_last = act_last  # or speed_last
-                    who_last = "same"
-                first_last_act_speed_df = pd.concat(
-                    [first_last_act_speed_df, pd.DataFrame({"date": [date], "feeding_event": [feeding_event[0]],
-                                                            "who_first": who_first, "value_first": [value_first],
-                                                            "who_last": [who_last], "value_last": [value_last]})])
+    for feeding_start, feeding_end in zip(feedings["start"], feedings["end"]):
+        date = feeding_start.date()
+        faa_act_of_the_day = faa_act_expanded.loc[faa_act_expanded["Time (corrected)"].dt.date == date]
+        faa_speed_of_the_day = faa_speed_expanded.loc[faa_speed_expanded["Time (corrected)"].dt.date == date]
+
+        prev_timestamp = feeding_start - pd.Timedelta(minutes=10)
+        minutes_to_add = (10 - prev_timestamp.minute % 10) if prev_timestamp.minute % 10 != 0 else 0
+        prev_timestamp = prev_timestamp + pd.Timedelta(minutes=minutes_to_add)
+        while faa_act_of_the_day['Time (corrected)'].isin([prev_timestamp]).any():
+            prev_timestamp -= pd.Timedelta(minutes=10)
+        act_first = prev_timestamp + pd.Timedelta(minutes=10)
+
+        prev_timestamp = feeding_start - pd.Timedelta(minutes=10)
+        minutes_to_add = (10 - prev_timestamp.minute % 10) if prev_timestamp.minute % 10 != 0 else 0
+        prev_timestamp = prev_timestamp + pd.Timedelta(minutes=minutes_to_add)
+        while faa_speed_of_the_day['Time (corrected)'].isin([prev_timestamp]).any():
+            prev_timestamp -= pd.Timedelta(minutes=10)
+        speed_first = prev_timestamp + pd.Timedelta(minutes=10)
+
+        if act_first < speed_first:
+            value_first = act_first
+            who_first = "act"
+        elif act_first > speed_first:
+            value_first = speed_first
+            who_first = "speed"
+        else:
+            value_first = act_first  # or speed_first
+            who_first = "same"
+
+        prev_timestamp = feeding_end + pd.Timedelta(hours=cutoff_additional_hours) + pd.Timedelta(minutes=10)
+        prev_timestamp = prev_timestamp - pd.Timedelta(minutes=prev_timestamp.minute % 10)
+        while faa_act_of_the_day['Time (corrected)'].isin([prev_timestamp]).any():
+            prev_timestamp += pd.Timedelta(minutes=10)
+        act_last = prev_timestamp - pd.Timedelta(minutes=10)
+
+        prev_timestamp = feeding_end + pd.Timedelta(hours=cutoff_additional_hours) + pd.Timedelta(minutes=10)
+        prev_timestamp = prev_timestamp - pd.Timedelta(minutes=prev_timestamp.minute % 10)
+        while faa_speed_of_the_day['Time (corrected)'].isin([prev_timestamp]).any():
+            prev_timestamp += pd.Timedelta(minutes=10)
+        speed_last = prev_timestamp - pd.Timedelta(minutes=10)
+
+        if act_last > speed_last:
+            value_last = act_last
+            who_last = "act"
+        elif act_last < speed_last:
+            value_last = speed_last
+            who_last = "speed"
+        else:
+            value_last = act_last  # or speed_last
+            who_last = "same"
+        feeding_event = feeding_start.strftime("%H:%M:%S")
+        first_last_act_speed_df = pd.concat(
+            [first_last_act_speed_df, pd.DataFrame({"date": [date], "feeding_event": [feeding_event],
+                                                    "who_first": who_first, "value_first": [value_first],
+                                                    "who_last": [who_last], "value_last": [value_last]})])
     print(first_last_act_speed_df)
     time.sleep(1)
     seq_length = len(first_last_act_speed_df)
@@ -309,19 +307,20 @@ def run_related_t_test(df, data_type, section: str = None):
 
 
 def run_t_test_mean_stats():
-    df_act = init_standard_data(include_random_phases=False)
-    df_depth = init_standard_data(include_random_phases=False, data_type="Depth [m] (est. or from tag)")
+    dfs = init_standard_data_for_types(["activity", "Depth [m] (est. or from tag)"], include_random_phases=False)
+    df_act = dfs["activity"]
+    df_depth = dfs["Depth [m] (est. or from tag)"]
     df_act["datum"] = df_act.index
     df_act = filter_by_valid_days(df_act)
 
     df_depth["date"] = df_depth.index.date
     df_depth["datum"] = df_depth.index
-    df_depth['experiment_section'] = df_depth.apply(assign_experiment_section, axis=1)
+    df_depth['experiment_section'] = assign_sections(df_depth["date"])
 
     df_speed = init_speed_data()
     df_speed["date"] = df_speed.index.date
     df_speed["datum"] = df_speed.index
-    df_speed['experiment_section'] = df_speed.apply(assign_experiment_section, axis=1)
+    df_speed['experiment_section'] = assign_sections(df_speed["date"])
 
     mean_df_act = mean_around_feeding(df_act.copy(), 1, 2, type="activity", calc_mean=True)
     mean_df_depth = mean_around_feeding(df_depth.copy(), 1, 2, type="Depth [m] (est. or from tag)", calc_mean=True)
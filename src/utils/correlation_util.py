@@ -0,0 +1,129 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import fft
+from scipy.stats import norm
+
+# Spectra of recently used (centered) series by content and transform length, shared by all calls
+_SPECTRUM_CACHE = OrderedDict()
+_SPECTRUM_CACHE_SIZE = 64
+
+
+def _spectrum(centered: np.ndarray, n_fft: int) -> np.ndarray:
+    """rfft of one centered series zero padded to n_fft, from the cache if the same series was transformed before"""
+    key = (hashlib.sha1(centered.tobytes()).hexdigest(), len(centered), n_fft)
+    spectrum = _SPECTRUM_CACHE.get(key)
+    if spectrum is None:
+        spectrum = fft.rfft(centered, n=n_fft)
+        _SPECTRUM_CACHE[key] = spectrum
+        if len(_SPECTRUM_CACHE) > _SPECTRUM_CACHE_SIZE:
+            _SPECTRUM_CACHE.popitem(last=False)
+    else:
+        _SPECTRUM_CACHE.move_to_end(key)
+    return spectrum
+
+
+def _as_columns(values) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    return values[:, None] if values.ndim == 1 else values
+
+
+def cross_correlation(x, y=None, max_lag=None, use_cache=True):
+    """
+    Normalised cross-correlation of make_cross_correlation for the lags -max_lag..max_lag only: the sum of
+    (x[t + lag] - mean(x)) * (y[t] - mean(y)) divided by std(x) * std(y) * n, computed with FFTs of length
+    >= n + max_lag (no wrap around) instead of the O(n^2) np.correlate(mode="full").
+    :param x: Series of length n, or 2-D with one series per column
+    :param y: Same length as x, 1-D or 2-D, by default x (all pairs of the columns of x)
+    :param max_lag: Largest lag, by default n - 1 (all lags of np.correlate)
+    :param use_cache: Keep the spectra for later calls, off for series that are used once (e.g. surrogates)
+    :return: The lags and the correlation per lag, shaped (lags,) for two series and (lags, x columns, y columns)
+    if any input is 2-D
+    """
+    is_matrix = np.ndim(x) == 2 or (y is not None and np.ndim(y) == 2)
+    x = _as_columns(x)
+    y = x if y is None else _as_columns(y)
+    length = len(x)
+    if len(y) != length:
+        raise ValueError(f"Series of equal length expected, got {length} and {len(y)}")
+    max_lag = length - 1 if max_lag is None else min(max_lag, length - 1)
+    n_fft = fft.next_fast_len(length + max_lag, real=True)
+    x_centered = x - x.mean(axis=0)
+    y_centered = y - y.mean(axis=0)
+    if use_cache:
+        x_spectra = np.stack([_spectrum(np.ascontiguousarray(column), n_fft) for column in x_centered.T], axis=1)
+        y_spectra = np.stack([_spectrum(np.ascontiguousarray(column), n_fft) for column in y_centered.T], axis=1)
+    else:
+        x_spectra = fft.rfft(x_centered, n=n_fft, axis=0)
+        y_spectra = fft.rfft(y_centered, n=n_fft, axis=0)
+    circular = fft.irfft(x_spectra[:, :, None] * np.conj(y_spectra[:, None, :]), n=n_fft, axis=0)
+    lags = np.arange(-max_lag, max_lag + 1)
+    correlation = circular[lags % n_fft] / (np.outer(x.std(axis=0), y.std(axis=0)) * length)
+    return lags, correlation if is_matrix else correlation[:, 0, 0]
+
+
+def cross_correlation_frame(df: pd.DataFrame, max_lag: int) -> pd.DataFrame:
+    """
+    Cross-correlation of every pair of columns (e.g. fish and variable) of a df on a common index
+    :return: df indexed by lag with the column pairs as columns
+    """
+    lags, correlation = cross_correlation(df.to_numpy(), max_lag=max_lag)
+    columns = pd.MultiIndex.from_product([df.columns, df.columns], names=["x", "y"])
+    return pd.DataFrame(correlation.reshape(len(lags), -1), index=pd.Index(lags, name="lag"), columns=columns)
+
+
+def confidence_line(n: int, conf=0.95) -> float:
+    """qnorm((1 + ci)/2)/sqrt(x$n.used) formula used in stats:::plot.acf in ccf function"""
+    return norm.ppf((1 + conf) / 2) / np.sqrt(n)
+
+
+def autocorrelation(series, max_lag: int, alpha=0.05):
+    """
+    ACF of statsmodels acf(x, nlags=max_lag, alpha=alpha) (not adjusted, FFT) and the half width of its Bartlett
+    confidence interval, for the lags 0..max_lag only. All series are transformed as one zero padded batch.
+    :param series: One series or a list of series of any lengths (e.g. one per section)
+    :return: ACF and band, shaped (max_lag + 1,) for one series or (series, max_lag + 1) for a list, NaN beyond the
+    length of a series
+    """
+    is_list = isinstance(series, (list, tuple))
+    series = [np.asarray(values, dtype=np.float64) for values in (series if is_list else [series])]
+    lengths = np.array([len(values) for values in series])
+    n_fft = fft.next_fast_len(int(lengths.max()) + max_lag, real=True)
+    centered = np.zeros((len(series), int(lengths.max())))
+    for row, values in enumerate(series):
+        centered[row, :len(values)] = values - values.mean()
+    spectra = fft.rfft(centered, n=n_fft, axis=1)
+    autocovariance = fft.irfft(spectra * np.conj(spectra), n=n_fft, axis=1)[:, :max_lag + 1]
+    acf_values = autocovariance / autocovariance[:, :1]
+    lag_numbers = np.arange(max_lag + 1)
+    acf_values[lag_numbers[None, :] >= lengths[:, None]] = np.nan
+    # Bartlett: var(acf[k]) = (1 + 2 * sum(acf[1:k] ** 2)) / n, with var(acf[0]) = 0 and var(acf[1]) = 1 / n
+    variance = np.ones_like(acf_values) / lengths[:, None]
+    variance[:, 0] = 0
+    variance[:, 2:] *= 1 + 2 * np.cumsum(acf_values[:, 1:-1] ** 2, axis=1)
+    band = norm.ppf(1 - alpha / 2) * np.sqrt(variance)
+    return (acf_values, band) if is_list else (acf_values[0], band[0])
+
+
+def estimate_period(acf_values: np.ndarray, find_p1_min: int, find_p1_max: int):
+    """Lag of the highest ACF value (P1) in find_p1_min..find_p1_max - 1, one per row for a 2-D ACF"""
+    return np.nanargmax(acf_values[..., find_p1_min:find_p1_max], axis=-1) + find_p1_min
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    n = 40 * 144
+    x, y = rng.normal(size=n).cumsum(), rng.normal(size=n).cumsum()
+    start = time.perf_counter()
+    expected = np.correlate(x - np.mean(x), y - np.mean(y), mode="full") / (np.std(x) * np.std(y) * n)
+    print(f"np.correlate: {time.perf_counter() - start:.3f}s")
+    start = time.perf_counter()
+    lags, result = cross_correlation(x, y, max_lag=144)
+    print(f"cross_correlation: {time.perf_counter() - start:.3f}s")
+    assert np.allclose(result, expected[n - 1 + lags], rtol=0, atol=1e-12)
+    matrix = cross_correlation_frame(pd.DataFrame(rng.normal(size=(n, 8))), max_lag=144)
+    print(f"All {matrix.shape[1]} column pairs in one call, equal to np.correlate")
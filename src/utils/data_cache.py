@@ -0,0 +1,189 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import zipfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.utils.project_constants import ProjectConstants
+
+# Bump whenever the loading pipeline changes in a way that alters the cached results
+CACHE_FORMAT_VERSION = 1
+
+
+def fingerprint_source_files(directory: Path = None, pattern: str = "*.csv") -> str:
+    """Hash name, size and modification time of every source file, so any change of the inputs changes the key"""
+    directory = ProjectConstants.CONSTRAINED_TRANSMITTER_DATA if directory is None else directory
+    fingerprint = hashlib.sha1()
+    for file in sorted(directory.glob(pattern)):
+        stat = file.stat()
+        fingerprint.update(f"{file.name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return fingerprint.hexdigest()
+
+
+def cache_key(name: str, sources: str, **parameters) -> str:
+    """Build the cache key from the entry name, the source fingerprint and all loader parameters"""
+    payload = json.dumps({"name": name, "version": CACHE_FORMAT_VERSION, "sources": sources,
+                          "parameters": parameters}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:20]
+
+
+def cache_path(key: str) -> Path:
+    return ProjectConstants.CACHE.joinpath(key).with_suffix(".npz")
+
+
+def _encode_values(values, prefix: str, arrays: dict) -> dict:
+    """Store one column as plain numpy arrays and return how to restore it"""
+    if isinstance(values, pd.arrays.PandasArray):
+        values = values.to_numpy()
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        arrays[f"{prefix}_codes"] = values.codes
+        arrays[f"{prefix}_categories"] = values.categories.to_numpy(dtype=str)
+        return {"kind": "category"}
+    if isinstance(values.dtype, pd.DatetimeTZDtype) or np.issubdtype(values.dtype, np.datetime64):
+        timestamps = pd.DatetimeIndex(values)
+        arrays[prefix] = timestamps.asi8
+        return {"kind": "datetime", "tz": None if timestamps.tz is None else str(timestamps.tz),
+                "freq": getattr(values, "freqstr", None)}
+    if values.dtype == object:
+        if pd.api.types.infer_dtype(values, skipna=True) not in ("string", "empty"):
+            raise TypeError(f"Column {prefix} holds objects other than strings and cannot be cached")
+        codes, uniques = pd.factorize(values)
+        arrays[f"{prefix}_codes"] = codes.astype(np.int32)
+        arrays[f"{prefix}_categories"] = np.asarray(uniques, dtype=str)
+        return {"kind": "object"}
+    arrays[prefix] = np.asarray(values)
+    return {"kind": "numeric"}
+
+
+def _decode_values(spec: dict, prefix: str, arrays):
+    if spec["kind"] == "category":
+        return pd.Categorical.from_codes(arrays[f"{prefix}_codes"], arrays[f"{prefix}_categories"])
+    if spec["kind"] == "datetime":
+        timestamps = pd.DatetimeIndex(arrays[prefix].view("datetime64[ns]"))
+        if spec["tz"] is not None:
+            timestamps = timestamps.tz_localize("UTC").tz_convert(spec["tz"])
+        return pd.DatetimeIndex(timestamps, freq=spec["freq"])
+    if spec["kind"] == "object":
+        codes = arrays[f"{prefix}_codes"]
+        values = arrays[f"{prefix}_categories"].astype(object)[codes]
+        values[codes == -1] = np.nan
+        return values
+    return arrays[prefix]
+
+
+def write_cached_df(df: pd.DataFrame, key: str, name: str, parameters: dict):
+    """Write the frame column by column into a compressed npz file and evict old entries if needed"""
+    ProjectConstants.CACHE.mkdir(parents=True, exist_ok=True)
+    arrays = {}
+    meta = {"name": name, "parameters": parameters, "created": time.time(), "index_name": df.index.name,
+            "index": _encode_values(df.index, "index", arrays), "columns": []}
+    for position, column in enumerate(df.columns):
+        meta["columns"].append([column, _encode_values(df[column].array, f"column_{position}", arrays)])
+    arrays["meta"] = np.array(json.dumps(meta, default=str))
+    path = cache_path(key)
+    temporary_path = path.with_suffix(".npz.tmp")
+    with open(temporary_path, "wb") as file:
+        np.savez_compressed(file, **arrays)
+    os.replace(temporary_path, path)
+    evict_cache()
+
+
+def read_cached_df(key: str) -> Optional[pd.DataFrame]:
+    """Return the cached frame for the key or None on a cache miss"""
+    path = cache_path(key)
+    if not path.exists():
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            index = pd.Index(_decode_values(meta["index"], "index", arrays), name=meta["index_name"])
+            df = pd.DataFrame({column: _decode_values(spec, f"column_{position}", arrays)
+                               for position, (column, spec) in enumerate(meta["columns"])}, index=index)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        print(f"Cache entry {key} is unreadable ({e}), removing it")
+        path.unlink(missing_ok=True)
+        return None
+    # Mark as recently used for the eviction
+    os.utime(path)
+    return df
+
+
+def evict_cache(max_bytes: int = None):
+    """Remove the least recently used entries until the cache fits into max_bytes"""
+    max_bytes = ProjectConstants.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = sorted(ProjectConstants.CACHE.glob("*.npz"), key=lambda entry: entry.stat().st_mtime)
+    total_bytes = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total_bytes <= max_bytes:
+            break
+        total_bytes -= entry.stat().st_size
+        entry.unlink()
+        print(f"Evicted cache entry {entry.stem}")
+
+
+def _read_meta(path: Path) -> dict:
+    with np.load(path, allow_pickle=False) as arrays:
+        return json.loads(str(arrays["meta"]))
+
+
+def inspect_cache() -> pd.DataFrame:
+    """List all cache entries with their size, last use and loader parameters"""
+    rows = []
+    for path in sorted(ProjectConstants.CACHE.glob("*.npz")):
+        try:
+            meta = _read_meta(path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            meta = {"name": "UNREADABLE", "parameters": {}}
+        stat = path.stat()
+        rows.append({"key": path.stem, "name": meta["name"], "size_bytes": stat.st_size,
+                     "last_used": pd.Timestamp(stat.st_mtime, unit="s"), "parameters": meta["parameters"]})
+    return pd.DataFrame(rows, columns=["key", "name", "size_bytes", "last_used", "parameters"])
+
+
+def invalidate_cache(name: str = None) -> int:
+    """Remove all cache entries, or only the ones with the given entry name, and return how many were removed"""
+    removed = 0
+    for path in ProjectConstants.CACHE.glob("*.npz"):
+        if name is not None:
+            try:
+                if _read_meta(path)["name"] != name:
+                    continue
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                pass
+        path.unlink()
+        removed += 1
+    print(f"Removed {removed} cache entries")
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the data cache")
+    parser.add_argument("command", choices=["inspect", "invalidate", "check"])
+    parser.add_argument("--name", default=None, help="Only invalidate entries with this name")
+    args = parser.parse_args()
+    if args.command == "check":
+        # Write and read back a frame with every supported kind of column
+        times = pd.date_range("2023-06-02", periods=4, freq="10min")
+        expected = pd.DataFrame({"fish_name": pd.Categorical(["a", "b", "a", "c"]),
+                                 "tag": ["x", None, "y", "x"],
+                                 "date": times.tz_localize("UTC").tz_convert("Europe/Berlin"),
+                                 "activity": np.arange(4, dtype=np.float64)},
+                                index=pd.Index(times, name="Time (corrected)"))
+        check_key = cache_key("round_trip_check", "", time=time.time())
+        write_cached_df(expected, check_key, "round_trip_check", {})
+        try:
+            pd.testing.assert_frame_equal(read_cached_df(check_key), expected)
+        finally:
+            cache_path(check_key).unlink(missing_ok=True)
+        print("Round trip of categorical, string, tz-aware and numeric columns is exact")
+    elif args.command == "inspect":
+        with pd.option_context("display.max_colwidth", None, "display.width", 200):
+            print(inspect_cache())
+    else:
+        invalidate_cache(args.name)
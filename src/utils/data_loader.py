@@ -1,8 +1,11 @@
+import numpy as np
 import pandas
 import pandas as pd
 
+from src.utils.data_cache import cache_key, fingerprint_source_files, read_cached_df, write_cached_df
+from src.utils.data_loader_streaming import init_data_streaming
 from src.utils.filter_util import cut_by_start_date, filter_by_snr, cut_by_end_date, \
-    reduce_to_interpolated_values_with_sections_df
+    reduce_to_interpolated_values_with_sections_df, get_detection_times
 from src.utils.pinpoint_data_converter import convert_data2, exclude_all_outliers
 from src.utils.project_constants import ProjectConstants
 from src.utils.transmitter_datasheets import TransmitterDataSheet
@@ -17,44 +20,126 @@ def add_water_columns(df):
     return df
 
 
-def init_standard_data(with_dates=True, use_cache=True, include_random_phases=False, data_type="activity"):
-    if use_cache:
-        try:
-            df = pandas.read_pickle(
-                ProjectConstants.DATA.joinpath(
-                    f'cached_df_2023_{data_type}_{include_random_phases}.pkl').as_posix())
-            print("Manual cache used!")
-            return df
-        except:
-            print("Loading manually...")
-    df = init_data([], all_fish=True, start_date="2023-06-02", end_date="2023-07-20",
-                   snr_slider_values=[20, 100000], with_dates=with_dates)
+def init_standard_data(with_dates=True, use_cache=True, include_random_phases=False, data_type="activity",
+                       n_workers=1, start_date="2023-06-02", end_date="2023-07-20", snr_slider_values=(20, 100000),
+                       minutes=10, compact=False):
+    return init_standard_data_for_types([data_type], with_dates=with_dates, use_cache=use_cache,
+                                        include_random_phases=include_random_phases, n_workers=n_workers,
+                                        start_date=start_date, end_date=end_date,
+                                        snr_slider_values=snr_slider_values, minutes=minutes,
+                                        compact=compact)[data_type]
+
+
+def load_standard_detections(with_dates=True, n_workers=1, start_date="2023-06-02", end_date="2023-07-20",
+                             snr_slider_values=(20, 100000), compact=False) -> pd.DataFrame:
+    """Cleaned detections of all fish within the paper period, the input of the standard data"""
+    df = init_data([], all_fish=True, start_date=start_date, end_date=end_date,
+                   snr_slider_values=list(snr_slider_values), with_dates=with_dates, n_workers=n_workers,
+                   compact=compact)
     df['hour'] = df.index.get_level_values(1).hour
     df['minute'] = df.index.get_level_values(1).minute
     df['second'] = df.index.get_level_values(1).second
     df['time_numeric'] = df['hour'] + df['minute'] / 60 + df['second'] / 3600
     try:
-        df = df[(df["datum"]) < pd.Timestamp(ProjectConstants.END_OF_EXPERIMENT_PERIOD_PAPER_EXCLUSIVE, tz="UTC")]
-        df = df[df["datum"] > pd.Timestamp(ProjectConstants.FISH_EXPERIMENT_SECTION_1, tz="UTC")]
+        df = df[get_detection_times(df) < pd.Timestamp(ProjectConstants.END_OF_EXPERIMENT_PERIOD_PAPER_EXCLUSIVE,
+                                                        tz="UTC")]
+        df = df[get_detection_times(df) > pd.Timestamp(ProjectConstants.FISH_EXPERIMENT_SECTION_1, tz="UTC")]
     except TypeError as e:
-        df = df[(df["datum"]) < pd.Timestamp(ProjectConstants.END_OF_EXPERIMENT_PERIOD_PAPER_EXCLUSIVE)]
-        df = df[df["datum"] > pd.Timestamp(ProjectConstants.FISH_EXPERIMENT_SECTION_1)]
+        df = df[get_detection_times(df) < pd.Timestamp(ProjectConstants.END_OF_EXPERIMENT_PERIOD_PAPER_EXCLUSIVE)]
+        df = df[get_detection_times(df) > pd.Timestamp(ProjectConstants.FISH_EXPERIMENT_SECTION_1)]
+    return df
+
 
-    df = reduce_to_interpolated_values_with_sections_df(df, minutes=10, include_random_phases=include_random_phases,
-                                                        data_type=data_type)
+def init_standard_data_for_types(data_types, with_dates=True, use_cache=True, include_random_phases=False,
+                                 n_workers=1, start_date="2023-06-02", end_date="2023-07-20",
+                                 snr_slider_values=(20, 100000), minutes=10, compact=False) -> dict:
+    """
+    Standard data for several data types at once, e.g. ["activity", "Depth [m] (est. or from tag)", "temperature"].
+    The csv files are loaded, filtered and cleaned only once for all data types missing in the cache,
+    every data type is cached on its own (same entries as init_standard_data).
+    :return: Dict of data type to the resampled, interpolated and section labelled df
+    """
+    dfs = {}
+    keys = {}
+    parameters = {}
+    sources = fingerprint_source_files() if use_cache else None
+    for data_type in data_types:
+        parameters[data_type] = {"with_dates": with_dates, "compact": compact,
+                                 "include_random_phases": include_random_phases, "data_type": data_type,
+                                 "start_date": start_date, "end_date": end_date,
+                                 "snr_slider_values": list(snr_slider_values), "minutes": minutes,
+                                 "window": [ProjectConstants.FISH_EXPERIMENT_SECTION_1,
+                                            ProjectConstants.END_OF_EXPERIMENT_PERIOD_PAPER_EXCLUSIVE],
+                                 "sections": ProjectConstants.EXPERIMENT_SECTIONS_DICT}
+        if use_cache:
+            keys[data_type] = cache_key("standard_data", sources, **parameters[data_type])
+            df = read_cached_df(keys[data_type])
+            if df is not None:
+                print(f"Cache used ({keys[data_type]})!")
+                dfs[data_type] = df
+    missing_data_types = [data_type for data_type in data_types if data_type not in dfs]
+    if not missing_data_types:
+        return dfs
     if use_cache:
-        df.to_pickle(
-            ProjectConstants.DATA.joinpath(f'cached_df_2023_{data_type}_{include_random_phases}.pkl').as_posix())
+        print("Loading manually...")
+    df = load_standard_detections(with_dates=with_dates, n_workers=n_workers, start_date=start_date,
+                                  end_date=end_date, snr_slider_values=snr_slider_values, compact=compact)
+
+    for data_type in missing_data_types:
+        dfs[data_type] = reduce_to_interpolated_values_with_sections_df(df, minutes=minutes,
+                                                                        include_random_phases=include_random_phases,
+                                                                        data_type=data_type)
+        if use_cache:
+            write_cached_df(dfs[data_type], keys[data_type], "standard_data", parameters[data_type])
+    return dfs
+
+
+def get_transmitter_files(files, all_fish):
+    """Resolve the csv files of all fish or the ones starting with the given names"""
+    if all_fish:
+        return list(ProjectConstants.CONSTRAINED_TRANSMITTER_DATA.glob("*.csv"))
+    return [real_file for file in files
+            for real_file in ProjectConstants.CONSTRAINED_TRANSMITTER_DATA.glob(file + "*.csv")]
+
 
+def downcast_detection_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Downcast floats to float32 and integers to the smallest signed type, printing the bytes saved per column"""
+    dtypes = {}
+    for column in df.columns:
+        if pd.api.types.is_float_dtype(df[column]):
+            dtypes[column] = np.float32
+        elif pd.api.types.is_integer_dtype(df[column]):
+            dtypes[column] = pd.to_numeric(df[column], downcast="integer").dtype
+    memory_before = df.memory_usage(deep=True, index=False)
+    df = df.astype(dtypes)
+    memory_after = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({"dtype": df.dtypes, "bytes_before": memory_before, "bytes_after": memory_after,
+                           "bytes_saved": memory_before - memory_after})
+    print(report)
+    print(f"Compact dtypes saved {report['bytes_saved'].sum() / 1024 ** 2:.1f} MiB "
+          f"({memory_before.sum() / 1024 ** 2:.1f} -> {memory_after.sum() / 1024 ** 2:.1f} MiB)")
     return df
 
 
 def init_data(files, all_fish, start_date, end_date, snr_slider_values,
-              with_dates=True) -> pandas.DataFrame:
+              with_dates=True, n_workers=1, streaming=False, chunksize=100000, compact=False) -> pandas.DataFrame:
+    """
+    Load, filter and convert the transmitter detections
+    :param n_workers: Number of processes reading the csv files when all fish are loaded, 1 reads them serially
+    :param streaming: Read the csv files in chunks with filters and outlier statistics computed per chunk,
+    for data sets that do not fit into memory before filtering
+    :param chunksize: Number of csv rows per chunk in streaming mode
+    :param compact: Only read the needed columns, keep the detection time solely in the index, store the tag names
+    as categories and downcast the numeric columns after the outlier exclusion
+    """
+    if streaming:
+        df = init_data_streaming(get_transmitter_files(files, all_fish), start_date, end_date, snr_slider_values,
+                                 with_dates=with_dates, chunksize=chunksize, compact=compact)
+        return downcast_detection_df(df) if compact else df
     if all_fish:
-        data_sheet = TransmitterDataSheet(empty=False)
+        data_sheet = TransmitterDataSheet(empty=False, n_workers=n_workers, compact=compact)
     else:
-        data_sheet = TransmitterDataSheet(empty=True)
+        data_sheet = TransmitterDataSheet(empty=True, compact=compact)
         try:
             print(len(files))
             print(files)
@@ -81,11 +166,14 @@ def init_data(files, all_fish, start_date, end_date, snr_slider_values,
     df = filter_by_snr(df, snr_slider_values[0], snr_slider_values[1])
     df = convert_data2(df)
     try:
+        # Compact frames never read most of these columns
         df = df.drop(columns=["Raw Data", "Data 1 unit", "Temperature / RMS (Data 2)", "Data 2", "Unix Timestamp (UTC)",
-                              "Data 2 unit"])
+                              "Data 2 unit"], errors="ignore" if compact else "raise")
     except KeyError as e:
         print("Tried to drop some columns, failed")
     df = exclude_all_outliers(df)
+    if compact:
+        df = downcast_detection_df(df)
     return df
 
 
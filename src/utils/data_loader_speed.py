@@ -1,8 +1,9 @@
 import numpy as np
 import pandas as pd
 
-from src.utils.filter_util import assign_experiment_section
+from src.utils.filter_util import assign_sections
 from src.utils.project_constants import ProjectConstants
+from src.utils.resample_util import resample_mean
 
 
 def init_speed_data(minutes: int = 10, include_random_phases=False, interpolate=True):
@@ -15,12 +16,10 @@ def init_speed_data(minutes: int = 10, include_random_phases=False, interpolate=
     start_of_activity_logs = pd.to_datetime("2023-06-02")
     end_of_activity_logs = pd.to_datetime("2023-07-13")
 
-    df_speed = df_speed.resample(f'{minutes}min', label='left', closed='left',
-                                 offset=f"{0}min",
-                                 on="Time (corrected)").mean()  # STATS 0.1
+    df_speed = resample_mean(df_speed, minutes, ["speed"], on="Time (corrected)")  # STATS 0.1
 
     df_speed["date"] = df_speed.index.date
-    df_speed['section'] = df_speed.apply(assign_experiment_section, axis=1)
+    df_speed['section'] = assign_sections(df_speed.index)
     if not include_random_phases:
         df_speed = df_speed.loc[
             (df_speed["section"] != "Irregular Phase 1") & (df_speed["section"] != "Irregular Phase 2")]
@@ -59,7 +58,7 @@ def spline_interpolation_of_speed_data(df_speed):
     df_speed_interpolated_spline = df_speed_as_freq.interpolate("slinear")
 
     df_speed_interpolated_spline["date"] = df_speed_interpolated_spline.index.date
-    df_speed_interpolated_spline['section'] = df_speed_interpolated_spline.apply(assign_experiment_section, axis=1)
+    df_speed_interpolated_spline['section'] = assign_sections(df_speed_interpolated_spline.index)
     df_speed_interpolated_spline = df_speed_interpolated_spline[["section", "speed"]]
     return df_speed_interpolated_spline
 
@@ -70,7 +69,7 @@ def zero_interpolation_of_speed_data(df_speed):
     df_speed_as_freq["speed"] = df_speed_as_freq['speed'].fillna(0)
 
     df_speed_as_freq["date"] = df_speed_as_freq.index.date
-    df_speed_as_freq['section'] = df_speed_as_freq.apply(assign_experiment_section, axis=1)
+    df_speed_as_freq['section'] = assign_sections(df_speed_as_freq.index)
     df_speed_as_freq = df_speed_as_freq[["section", "speed"]]
     return df_speed_as_freq
 
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+from src.utils.filter_util import cut_by_start_date, cut_by_end_date
+from src.utils.pinpoint_data_converter import convert_data2
+from src.utils.transmitter_datasheets import index_transmitter_df, get_fish_numbers, COMPACT_CSV_COLUMNS
+
+COLUMNS_TO_DROP = ["Raw Data", "Data 1 unit", "Temperature / RMS (Data 2)", "Data 2", "Unix Timestamp (UTC)",
+                   "Data 2 unit"]
+
+
+def _iterate_filtered_chunks(file, start_date, end_date, snr_slider_values, with_dates, chunksize, compact=False):
+    """Read one csv file in chunks and push the experiment window, date and SNR predicates down to each chunk"""
+    for chunk in pd.read_csv(file, header=0, skipinitialspace=True, chunksize=chunksize,
+                             usecols=COMPACT_CSV_COLUMNS if compact else None):
+        chunk = index_transmitter_df(chunk, compact=compact)
+        names = chunk["Name"].unique()
+        if with_dates:
+            chunk = cut_by_start_date(chunk, start_date)
+            chunk = cut_by_end_date(chunk, end_date)
+        chunk = chunk[(chunk["SNR [dB]"] >= snr_slider_values[0]) & (chunk["SNR [dB]"] < snr_slider_values[1])]
+        yield names, chunk
+
+
+def _merge_welford_statistics(statistics: pd.DataFrame, chunk_statistics: pd.DataFrame) -> pd.DataFrame:
+    """Combine running count, mean and sum of squared deviations per tag with the ones of a new chunk (Chan et al.)"""
+    statistics, chunk_statistics = statistics.align(chunk_statistics, fill_value=0)
+    count = statistics["count"] + chunk_statistics["count"]
+    delta = chunk_statistics["mean"] - statistics["mean"]
+    safe_count = count.where(count > 0, 1)
+    mean = statistics["mean"] + delta * chunk_statistics["count"] / safe_count
+    m2 = statistics["m2"] + chunk_statistics["m2"] + delta ** 2 * statistics["count"] * chunk_statistics[
+        "count"] / safe_count
+    return pd.DataFrame({"count": count, "mean": mean, "m2": m2})
+
+
+def _temperature_chunk_statistics(chunk: pd.DataFrame) -> pd.DataFrame:
+    temperature = chunk.loc[chunk["ID"] % 2 == 0, ["Name", "Temperature / RMS (Data 2)"]].dropna()
+    grouped = temperature.groupby("Name")["Temperature / RMS (Data 2)"]
+    count = grouped.count().astype(float)
+    mean = grouped.mean()
+    return pd.DataFrame({"count": count, "mean": mean, "m2": grouped.var(ddof=0) * count})
+
+
+def init_data_streaming(files, start_date, end_date, snr_slider_values, with_dates=True,
+                        chunksize=100000, compact=False) -> pd.DataFrame:
+    """
+    Load the detections chunk by chunk with the same result as init_data followed by exclude_all_outliers.
+    The first pass pushes the date and SNR filters down to each chunk and accumulates the per tag temperature
+    mean and variance online, the second pass re-reads the chunks and only keeps the rows that pass the
+    z-score and depth filters. Apart from the result, memory is bounded by the chunk size.
+    :param files: The csv files to load
+    :param chunksize: Number of csv rows held in memory at once
+    :param compact: Only read the needed columns and store the tag names as categories (see init_data)
+    """
+    names = set()
+    statistics = pd.DataFrame(columns=["count", "mean", "m2"], dtype=float)
+    for file in files:
+        for chunk_names, chunk in _iterate_filtered_chunks(file, start_date, end_date, snr_slider_values, with_dates,
+                                                           chunksize, compact):
+            names.update(chunk_names)
+            statistics = _merge_welford_statistics(statistics, _temperature_chunk_statistics(chunk))
+    statistics["std"] = np.sqrt(statistics["m2"] / statistics["count"])
+
+    fish_numbers = get_fish_numbers(names)
+    frames = {}
+    number_of_signals = 0
+    number_of_outliers = 0
+    for file in files:
+        kept_chunks = []
+        for _, chunk in _iterate_filtered_chunks(file, start_date, end_date, snr_slider_values, with_dates,
+                                                 chunksize, compact):
+            number_of_signals += len(chunk)
+            chunk = chunk.assign(fish_number=chunk["Name"].map(fish_numbers).astype(np.int64))
+            if compact:
+                # Same categories in every chunk, so the concatenation stays categorical
+                chunk = chunk.assign(Name=pd.Categorical(chunk["Name"], categories=sorted(names)))
+            chunk = convert_data2(chunk)
+            if compact:
+                chunk = chunk.drop(columns=COLUMNS_TO_DROP, errors="ignore")
+            elif all(column in chunk.columns for column in COLUMNS_TO_DROP):
+                chunk = chunk.drop(columns=COLUMNS_TO_DROP)
+            z_score = np.zeros(len(chunk))
+            is_temperature = chunk["is_temperature"].to_numpy()
+            tag_statistics = statistics.reindex(chunk.loc[is_temperature, "Name"])
+            z_score[is_temperature] = np.divide(
+                chunk.loc[is_temperature, "temperature"].to_numpy() - tag_statistics["mean"].to_numpy(),
+                tag_statistics["std"].to_numpy())
+            is_inlier = (z_score < 3) & (-3 < z_score)
+            number_of_outliers += int((~is_inlier).sum())
+            chunk = chunk.loc[is_inlier]
+            chunk = chunk.loc[chunk["Depth [m] (est. or from tag)"] <= 9]
+            chunk = chunk.loc[0 <= chunk["Depth [m] (est. or from tag)"]]
+            kept_chunks.append(chunk)
+        if kept_chunks:
+            frames[file.stem] = pd.concat(kept_chunks)
+    df = pd.concat(frames.values(), keys=frames.keys(), names=["fish_name", "dates"])
+    print(f"Signals after date and SNR [dB] filters: {number_of_signals}")
+    print(f"{number_of_outliers} outliers with (z_score > 3) excluded for column temperature")
+    print(f"After final exclusion: {len(df)}")
+    return df
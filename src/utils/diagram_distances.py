@@ -0,0 +1,183 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import maximum_bipartite_matching
+
+from src.utils.persistent_homology import get_segmented_persistent_homology
+from src.utils.resample_util import resample_statistics
+
+METRICS = ["bottleneck", "wasserstein"]
+
+
+def peaks_to_diagram(peaks_df: pd.DataFrame) -> np.ndarray:
+    """
+    Persistence diagram of a peaks table as (birth, death) value pairs, a peak is born at its value and dies at the
+    value of its saddle (the minimum for the peak that never dies). Peaks with persistence 0 lie on the diagonal and
+    do not change any distance, so they are left out.
+    """
+    value = peaks_df["value"].to_numpy(dtype=np.float64)
+    persistence = peaks_df["persistence"].to_numpy(dtype=np.float64)
+    is_used = persistence > 0
+    return np.column_stack([value[is_used], value[is_used] - persistence[is_used]])
+
+
+def daily_diagrams_per_fish(df: pd.DataFrame, type="activity", minutes=10) -> dict:
+    """
+    Persistence diagram of every fish and day, computed like calculate_persistence_per_fish
+    :param df: Cleaned detections, e.g. from load_standard_detections
+    :return: Dict of fish name to a dict of date to diagram
+    """
+    if type == "activity":
+        df = df.loc[df["is_activity"]]
+    elif type == "temperature":
+        df = df.loc[df["is_temperature"]]
+    on = "Time (corrected)" if "Time (corrected)" in df.columns else None
+    series = resample_statistics(df, minutes, [type], on=on, by="fish_name")[(type, "mean")].dropna()
+    fish_names = series.index.get_level_values(0)
+    days = series.index.get_level_values(1).normalize()
+    peaks_df = get_segmented_persistent_homology(series, pd.MultiIndex.from_arrays([fish_names, days]))
+    diagrams = {}
+    for (fish_name, day), segment_df in peaks_df.groupby("segment", sort=False):
+        diagrams.setdefault(fish_name, {})[day.date()] = peaks_to_diagram(segment_df)
+    return diagrams
+
+
+def _ground_distances(diagram_a: np.ndarray, diagram_b: np.ndarray):
+    """L-infinity distances between the points and from every point to the diagonal"""
+    between = np.maximum(np.abs(diagram_a[:, None, 0] - diagram_b[None, :, 0]),
+                         np.abs(diagram_a[:, None, 1] - diagram_b[None, :, 1]))
+    return between, (diagram_a[:, 0] - diagram_a[:, 1]) / 2, (diagram_b[:, 0] - diagram_b[:, 1]) / 2
+
+
+def _has_perfect_matching(between, to_diagonal_a, to_diagonal_b, epsilon) -> bool:
+    """
+    Whether all points can be matched within epsilon. Rows are the points of a and the diagonal copies of b,
+    columns the points of b and the diagonal copies of a, two diagonal copies always match.
+    """
+    n, m = between.shape
+    rows, columns = np.nonzero(between <= epsilon)
+    diagonal_a = np.flatnonzero(to_diagonal_a <= epsilon)
+    diagonal_b = np.flatnonzero(to_diagonal_b <= epsilon)
+    copies_b, copies_a = np.meshgrid(np.arange(m), np.arange(n), indexing="ij")
+    rows = np.concatenate([rows, diagonal_a, n + diagonal_b, n + copies_b.ravel()])
+    columns = np.concatenate([columns, m + diagonal_a, diagonal_b, m + copies_a.ravel()])
+    graph = csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, columns)), shape=(n + m, n + m))
+    return bool(np.all(maximum_bipartite_matching(graph, perm_type="column") >= 0))
+
+
+def bottleneck_distance(diagram_a: np.ndarray, diagram_b: np.ndarray) -> float:
+    """
+    Bottleneck distance between two diagrams: binary search over the candidate distances with a bipartite matching
+    (Hopcroft-Karp) per step. The search starts between a lower bound (every point needs some partner) and an upper
+    bound (all points to the diagonal) and stops right away if they meet.
+    """
+    between, to_diagonal_a, to_diagonal_b = _ground_distances(diagram_a, diagram_b)
+    if len(between) == 0 or len(between[0]) == 0:
+        return float(max(np.max(to_diagonal_a, initial=0), np.max(to_diagonal_b, initial=0)))
+    lower = max(np.max(np.minimum(to_diagonal_a, between.min(axis=1))),
+                np.max(np.minimum(to_diagonal_b, between.min(axis=0))))
+    upper = max(np.max(to_diagonal_a), np.max(to_diagonal_b))
+    if lower >= upper:
+        return float(upper)
+    candidates = np.unique(np.concatenate([between.ravel(), to_diagonal_a, to_diagonal_b]))
+    candidates = candidates[(candidates >= lower) & (candidates <= upper)]
+    if _has_perfect_matching(between, to_diagonal_a, to_diagonal_b, candidates[0]):
+        return float(candidates[0])
+    # candidates[low] is not feasible, candidates[high] (the upper bound) is
+    low, high = 0, len(candidates) - 1
+    while high - low > 1:
+        middle = (low + high) // 2
+        if _has_perfect_matching(between, to_diagonal_a, to_diagonal_b, candidates[middle]):
+            high = middle
+        else:
+            low = middle
+    return float(candidates[high])
+
+
+def wasserstein_distance(diagram_a: np.ndarray, diagram_b: np.ndarray) -> float:
+    """
+    1-Wasserstein distance between two diagrams (L-infinity ground distance): a linear sum assignment (Jonker-
+    Volgenant, in C) over the points of a plus the diagonal copies of b against the points of b plus the diagonal
+    copies of a. Every point can only go to its own diagonal copy, two copies match at no cost.
+    """
+    between, to_diagonal_a, to_diagonal_b = _ground_distances(diagram_a, diagram_b)
+    n, m = between.shape
+    if n == 0 or m == 0:
+        return float(np.sum(to_diagonal_a) + np.sum(to_diagonal_b))
+    # Larger than any full assignment, so a forbidden pair is never chosen
+    forbidden = 2 * (np.sum(to_diagonal_a) + np.sum(to_diagonal_b)) + 1
+    costs = np.zeros((n + m, m + n))
+    costs[:n, :m] = between
+    costs[:n, m:] = forbidden
+    costs[np.arange(n), m + np.arange(n)] = to_diagonal_a
+    costs[n:, :m] = forbidden
+    costs[n + np.arange(m), np.arange(m)] = to_diagonal_b
+    rows, columns = linear_sum_assignment(costs)
+    return float(costs[rows, columns].sum())
+
+
+def diagram_distance(diagram_a: np.ndarray, diagram_b: np.ndarray, metric="bottleneck") -> float:
+    if metric == "bottleneck":
+        return bottleneck_distance(diagram_a, diagram_b)
+    if metric == "wasserstein":
+        return wasserstein_distance(diagram_a, diagram_b)
+    raise AttributeError(f"Unknown metric {metric}, choose from {METRICS}")
+
+
+def _pair_distances(diagrams: list, pairs: np.ndarray, metric: str) -> np.ndarray:
+    return np.array([diagram_distance(diagrams[i], diagrams[j], metric) for i, j in pairs], dtype=np.float64)
+
+
+def diagram_distance_matrix(diagrams: list, metric="bottleneck", n_workers=1) -> np.ndarray:
+    """
+    Distances between all pairs of diagrams as a condensed matrix (order of scipy.spatial.distance.pdist), which
+    scipy.cluster.hierarchy.linkage and squareform take directly
+    :param n_workers: Number of processes for the pairs, 1 computes them serially
+    """
+    if metric not in METRICS:
+        raise AttributeError(f"Unknown metric {metric}, choose from {METRICS}")
+    diagrams = list(diagrams)
+    pairs = np.column_stack(np.triu_indices(len(diagrams), k=1))
+    if n_workers is not None and n_workers <= 1 or len(pairs) == 0:
+        return _pair_distances(diagrams, pairs, metric)
+    chunks = np.array_split(pairs, min(len(pairs), 4 * (n_workers or 8)))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = executor.map(_pair_distances, [diagrams] * len(chunks), chunks, [metric] * len(chunks))
+        return np.concatenate(list(results))
+
+
+def day_distance_matrices(df: pd.DataFrame, types=("activity",), metric="bottleneck", minutes=10,
+                          n_workers=1) -> dict:
+    """
+    Condensed day distance matrix of every variable and fish
+    :return: Dict of (type, fish name) to (dates, condensed distances)
+    """
+    matrices = {}
+    for type in types:
+        for fish_name, diagrams in daily_diagrams_per_fish(df, type=type, minutes=minutes).items():
+            matrices[(type, fish_name)] = (list(diagrams.keys()),
+                                           diagram_distance_matrix(diagrams.values(), metric, n_workers))
+    return matrices
+
+
+if __name__ == "__main__":
+    import time
+
+    from scipy.cluster.hierarchy import fcluster, linkage
+
+    from src.utils.data_loader import load_standard_detections
+    from src.utils.filter_util import assign_sections
+
+    detections = load_standard_detections()
+    for metric in METRICS:
+        start = time.perf_counter()
+        matrices = day_distance_matrices(detections, types=("activity", "temperature"), metric=metric, n_workers=4)
+        print(f"{metric}: {len(matrices)} matrices in {time.perf_counter() - start:.2f}s")
+    for (type, fish_name), (dates, distances) in matrices.items():
+        clusters = fcluster(linkage(distances, method="average"), t=4, criterion="maxclust")
+        sections = assign_sections(dates)
+        print(f"{type} {fish_name}:")
+        print(pd.crosstab(sections, clusters, rownames=["section"], colnames=["cluster"]))
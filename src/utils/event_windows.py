@@ -0,0 +1,170 @@
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from src.utils.resample_util import resample_statistics
+
+
+def to_naive_utc(timestamps) -> np.ndarray:
+    """datetime64 values to compare with naive timestamps, timezone aware ones in UTC (like pd.Timestamp(.., tz="UTC"))"""
+    timestamps = pd.DatetimeIndex(timestamps)
+    if timestamps.tz is not None:
+        timestamps = timestamps.tz_convert("UTC").tz_localize(None)
+    return timestamps.values
+
+
+def locate_windows(times, starts, ends):
+    """
+    Rows of every half open window [start, end) in one searchsorted pass over the sorted times
+    :param times: Timestamps of the rows in any order
+    :return: The row positions sorted by time (stable) and the first and last + 1 index into them per window
+    """
+    times = to_naive_utc(times)
+    order = np.argsort(times, kind="stable")
+    sorted_times = times[order]
+    lower = np.searchsorted(sorted_times, to_naive_utc(starts), side="left")
+    upper = np.searchsorted(sorted_times, to_naive_utc(ends), side="left")
+    return order, lower, np.maximum(upper, lower)
+
+
+def window_positions(order: np.ndarray, lower: np.ndarray, upper: np.ndarray):
+    """
+    Row positions of all windows concatenated, in the original row order within each window
+    :return: The positions and the window of each of them
+    """
+    counts = upper - lower
+    windows = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = order[np.repeat(lower, counts) + offsets]
+    resorted = np.lexsort((positions, windows))
+    return positions[resorted], windows[resorted]
+
+
+def window_mean_sem(values, order: np.ndarray, lower: np.ndarray, upper: np.ndarray):
+    """
+    Mean and standard error (ddof=1) of the non NaN values per window from cumulative sums, like Series.mean() and
+    Series.sem(). The values are centered first so that the sums of squares do not cancel.
+    """
+    values = np.asarray(values, dtype=np.float64)[order]
+    is_valid = ~np.isnan(values)
+    center = values[is_valid].mean() if is_valid.any() else 0.0
+    centered = np.where(is_valid, values - center, 0.0)
+    cumulative_count = np.concatenate([[0], np.cumsum(is_valid)])
+    cumulative_sum = np.concatenate([[0.0], np.cumsum(centered)])
+    cumulative_squares = np.concatenate([[0.0], np.cumsum(centered ** 2)])
+    counts = cumulative_count[upper] - cumulative_count[lower]
+    sums = cumulative_sum[upper] - cumulative_sum[lower]
+    squares = cumulative_squares[upper] - cumulative_squares[lower]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centered_mean = sums / counts
+        variance = np.maximum(squares - sums * centered_mean, 0) / (counts - 1)
+        sem = np.sqrt(variance / counts)
+    mean = np.where(counts > 0, centered_mean + center, np.nan)
+    return mean, np.where(counts > 1, sem, np.nan)
+
+
+class Epochs(NamedTuple):
+    """Peri-event epochs of extract_epochs"""
+    data: np.ndarray  # events x relative time bins x variables x fish
+    mask: np.ndarray  # True where the grid has no value (gap or outside the panel)
+    relative_times: pd.TimedeltaIndex
+    events: pd.DatetimeIndex
+    variables: pd.Index
+    fish: pd.Index
+
+
+def build_series_panel(df: pd.DataFrame, columns, minutes=10, on=None, by="fish_name") -> pd.DataFrame:
+    """
+    Mean of the columns per fish on a regular grid of the given minutes (bins without detections are NaN)
+    :return: df indexed by the left bin edges with the columns (variable, fish)
+    """
+    statistics = resample_statistics(df, minutes, columns, on=on, by=by)
+    statistics.columns = statistics.columns.get_level_values(0)
+    return statistics.unstack(level=0).rename_axis(columns=["variable", "fish"])
+
+
+def extract_epochs(series_panel: pd.DataFrame, events, before: pd.Timedelta, after: pd.Timedelta,
+                   freq=None) -> Epochs:
+    """
+    Dense array of the panel around every event, indexed as events x relative time bins x variables x fish. The
+    panel is put on a complete grid once and the epochs are taken from a strided sliding window view of it, an
+    event falls into the bin that contains it.
+    :param series_panel: Values indexed by time with the columns (variable, fish), e.g. from build_series_panel, or
+    plain columns (one fish)
+    :param events: Event times, e.g. feeding starts
+    :param before: Time before the event bin, rounded down to whole bins
+    :param after: Time from the event bin on, rounded up to whole bins
+    :param freq: Grid step, by default the freq of the index (or the smallest step between the timestamps)
+    """
+    index = pd.DatetimeIndex(series_panel.index)
+    if freq is None:
+        freq = index.freq if index.freq is not None else pd.Timedelta(np.diff(index.values).min())
+    freq = pd.Timedelta(freq)
+    grid = pd.date_range(index.min(), index.max(), freq=freq)
+    panel = series_panel.reindex(grid)
+    if not isinstance(panel.columns, pd.MultiIndex):
+        panel.columns = pd.MultiIndex.from_product([panel.columns, [None]], names=["variable", "fish"])
+    variables = panel.columns.get_level_values(0).unique()
+    fish = panel.columns.get_level_values(1).unique()
+    panel = panel.reindex(columns=pd.MultiIndex.from_product([variables, fish]))
+    values = panel.to_numpy(dtype=np.float32 if all(panel.dtypes == np.float32) else np.float64)
+
+    bins_before = int(before // freq)
+    bins_after = int(-(-after // freq))
+    width = bins_before + bins_after
+    events = pd.DatetimeIndex(events)
+    event_bins = (to_naive_utc(events) - to_naive_utc(grid[:1])[0]) // freq.to_timedelta64()
+    # One epoch of NaN on both sides, so that every epoch which touches the grid is one window of the view
+    padded = np.full((len(grid) + 2 * width, values.shape[1]), np.nan, dtype=values.dtype)
+    padded[width:width + len(grid)] = values
+    windows = np.lib.stride_tricks.sliding_window_view(padded, width, axis=0)
+    starts = event_bins.astype(np.int64) + bins_after
+    is_inside = (starts >= 0) & (starts < len(windows))
+    data = np.full((len(events), values.shape[1], width), np.nan, dtype=values.dtype)
+    data[is_inside] = windows[starts[is_inside]]
+    data = data.transpose(0, 2, 1).reshape(len(events), width, len(variables), len(fish))
+    relative_times = pd.to_timedelta(np.arange(-bins_before, bins_after) * freq)
+    return Epochs(data, np.isnan(data), relative_times, events, variables, fish)
+
+
+def epoch_mean_sem(epochs: Epochs, min_count=2):
+    """
+    Mean and standard error (ddof=1) over the events per relative time bin, variable and fish, ignoring the masked
+    values
+    :param min_count: Fewest events with a value for a mean, the rest is NaN
+    :return: Two arrays shaped relative time bins x variables x fish
+    """
+    counts = (~epochs.mask).sum(axis=0)
+    data = epochs.data.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(epochs.mask, 0, data).sum(axis=0) / counts
+        deviations = np.where(epochs.mask, 0, data - mean[None])
+        sem = np.sqrt((deviations ** 2).sum(axis=0) / (counts - 1) / counts)
+    mean[counts < min_count] = np.nan
+    sem[counts < min_count] = np.nan
+    return mean, sem
+
+
+if __name__ == "__main__":
+    import time
+
+    # Three fish with two variables on a 10 minute grid with a gap, epochs around daily events
+    rng = np.random.default_rng(0)
+    grid = pd.date_range("2023-05-01", "2023-06-10", freq="10min", inclusive="left")
+    columns = pd.MultiIndex.from_product([["activity", "speed"], ["fish_a", "fish_b", "fish_c"]])
+    panel = pd.DataFrame(rng.normal(size=(len(grid), len(columns))), index=grid, columns=columns)
+    panel = panel.drop(grid[1000:1300])
+    events = pd.date_range("2023-04-30 09:05", "2023-06-11 09:05", freq="1D")
+    before, after = pd.Timedelta(hours=4), pd.Timedelta(hours=2)
+    start = time.perf_counter()
+    epochs = extract_epochs(panel, events, before, after, freq="10min")
+    mean, sem = epoch_mean_sem(epochs)
+    print(f"extract_epochs: {epochs.data.shape} in {time.perf_counter() - start:.4f}s, "
+          f"{epochs.mask.mean():.1%} masked")
+    full = panel.reindex(grid)
+    for event_number, event in enumerate(events):
+        bins = event.floor("10min") + epochs.relative_times
+        expected = full.reindex(bins).to_numpy().reshape(len(bins), 2, 3)
+        assert np.array_equal(epochs.data[event_number], expected, equal_nan=True)
+    print("Equal to reindexing every epoch")
@@ -0,0 +1,116 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from src.utils.feeding_times import FeedingSchedule
+
+FAA_COLUMNS = ["fish", "date", "faa_start", "faa_end", "n_bins", "threshold"]
+
+
+def _wall_times(index) -> pd.DatetimeIndex:
+    index = pd.DatetimeIndex(index)
+    return index.tz_localize(None) if index.tz is not None else index
+
+
+def daily_quantiles(values: np.ndarray, day_codes: np.ndarray, quantile: float) -> np.ndarray:
+    """
+    Quantile of the non NaN values of every day and column, like Series.quantile per day (NaN for empty days)
+    :param values: Values shaped (time, columns)
+    :param day_codes: Day number 0.. of every row, ascending
+    :return: Array shaped (days, columns)
+    """
+    number_of_days = int(day_codes[-1]) + 1 if len(day_codes) else 0
+    first_rows = np.searchsorted(day_codes, np.arange(number_of_days))
+    slots = np.arange(len(day_codes)) - first_rows[day_codes]
+    by_day = np.full((number_of_days, int(slots.max()) + 1 if len(slots) else 0, values.shape[1]), np.nan)
+    by_day[day_codes, slots] = values
+    with warnings.catch_warnings():
+        # All NaN days
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanpercentile(by_day, quantile * 100, axis=1)
+
+
+def feeding_cutoff_mask(times: pd.DatetimeIndex, feeding_schedule: FeedingSchedule,
+                        cutoff_additional_hours=2) -> np.ndarray:
+    """
+    Rows in the time of day [feeding start, feeding end + cutoff_additional_hours) of a feeding on their day, a cutoff
+    past midnight wraps around to the morning of that day (like between_time)
+    :param times: Sorted naive timestamps
+    """
+    times = _wall_times(times)
+    days = feeding_schedule.starts.astype("datetime64[D]").astype("datetime64[ns]")
+    start_offsets = feeding_schedule.starts - days
+    cutoff_ends = feeding_schedule.ends + pd.Timedelta(hours=cutoff_additional_hours).to_timedelta64()
+    end_offsets = cutoff_ends - cutoff_ends.astype("datetime64[D]").astype("datetime64[ns]")
+    is_wrapped = end_offsets < start_offsets
+    one_day = np.timedelta64(1, "D")
+    # Every cutoff as one or two half open intervals within its day
+    interval_starts = np.concatenate([days + start_offsets, days[is_wrapped]])
+    interval_ends = np.concatenate([np.where(is_wrapped, days + one_day, days + end_offsets),
+                                    days[is_wrapped] + end_offsets[is_wrapped]])
+    is_used = interval_ends > interval_starts
+    coverage = np.zeros(len(times) + 1, dtype=np.int64)
+    np.add.at(coverage, np.searchsorted(times.values, interval_starts[is_used], side="left"), 1)
+    np.add.at(coverage, np.searchsorted(times.values, interval_ends[is_used], side="left"), -1)
+    return np.cumsum(coverage)[:-1] > 0
+
+
+def detect_faa(values: pd.DataFrame, minutes: int, duration_threshold_minutes=120, quantile=0.5,
+               feeding_schedule: FeedingSchedule = None, cutoff_additional_hours=2) -> pd.DataFrame:
+    """
+    Food anticipatory activity: runs of at least duration_threshold_minutes in which every value of a column is at or
+    above the quantile of its day. All days and columns are encoded at once with run lengths on the regular grid,
+    NaN values and the day boundaries end a run.
+    :param values: Resampled values on a grid of the given minutes, one column per fish (or one column for the group)
+    :param feeding_schedule: Also end the runs at the feedings of this schedule, from their start to their end plus
+    cutoff_additional_hours (the threshold still uses the whole day)
+    :return: Tidy df with one row per FAA window: the column it was found in, its day, the first and last bin, the
+    number of bins and the threshold of the day
+    """
+    step = pd.Timedelta(minutes=minutes)
+    times = _wall_times(values.index)
+    if len(times) == 0:
+        return pd.DataFrame(columns=FAA_COLUMNS)
+    grid = pd.date_range(times.min(), times.max(), freq=step)
+    data = values.set_axis(times).reindex(grid).to_numpy(dtype=np.float64)
+    day_values = grid.normalize().values
+    day_codes = np.concatenate([[0], np.cumsum(day_values[1:] != day_values[:-1])])
+    thresholds = daily_quantiles(data, day_codes, quantile)
+
+    with np.errstate(invalid="ignore"):
+        is_above = data >= thresholds[day_codes]
+    if feeding_schedule is not None:
+        is_above &= ~feeding_cutoff_mask(grid, feeding_schedule, cutoff_additional_hours)[:, None]
+    is_new_day = np.concatenate([[True], day_codes[1:] != day_codes[:-1]])
+    is_last_of_day = np.concatenate([is_new_day[1:], [True]])
+    previous_above = np.vstack([np.zeros((1, data.shape[1]), dtype=bool), is_above[:-1]]) & ~is_new_day[:, None]
+    next_above = np.vstack([is_above[1:], np.zeros((1, data.shape[1]), dtype=bool)]) & ~is_last_of_day[:, None]
+    # Column major, so that the starts and ends of the runs pair up in order
+    columns, first_rows = np.nonzero((is_above & ~previous_above).T)
+    _, last_rows = np.nonzero((is_above & ~next_above).T)
+    lengths = last_rows - first_rows + 1
+    is_faa = lengths >= int(duration_threshold_minutes / minutes)
+    columns, first_rows, last_rows = columns[is_faa], first_rows[is_faa], last_rows[is_faa]
+    return pd.DataFrame({"fish": values.columns[columns],
+                         "date": grid[first_rows].date,
+                         "faa_start": grid[first_rows],
+                         "faa_end": grid[last_rows],
+                         "n_bins": lengths[is_faa],
+                         "threshold": thresholds[day_codes[first_rows], columns]})
+
+
+if __name__ == "__main__":
+    import time
+
+    from src.utils.event_windows import build_series_panel
+    from src.utils.resample_util import _synthetic_detections
+
+    detections = _synthetic_detections(200_000)
+    panel = build_series_panel(detections, ["activity"], minutes=10, on="Time (corrected)")["activity"]
+    start = time.perf_counter()
+    faa = detect_faa(panel, 10, duration_threshold_minutes=60, quantile=0.5,
+                     feeding_schedule=FeedingSchedule.load().fill_days_without_feeding())
+    print(f"detect_faa: {len(faa)} FAA windows of {panel.shape[1]} fish over {len(panel)} bins in "
+          f"{time.perf_counter() - start:.3f}s")
+    print(faa.groupby("fish").size())
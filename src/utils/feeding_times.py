@@ -1,13 +1,179 @@
-import datetime as dt
 import json
+from pathlib import Path
 from typing import List
 
+import numpy as np
 import pandas
 import pandas as pd
 import plotly.graph_objs
 
+from src.utils.filter_util import assign_sections
 from src.utils.project_constants import ProjectConstants
 
+# Parsed schedule files by path and modification time, every file is read once
+_FEEDING_TIMES_DATA = {}
+_SCHEDULES = {}
+
+
+def _read_feeding_times_data(path: Path) -> dict:
+    key = (Path(path).as_posix(), Path(path).stat().st_mtime_ns)
+    if key not in _FEEDING_TIMES_DATA:
+        with open(path, 'r') as json_file:
+            _FEEDING_TIMES_DATA[key] = json.load(json_file)
+    return _FEEDING_TIMES_DATA[key]
+
+
+def _wall_times(timestamps) -> np.ndarray:
+    """Naive datetime64 values, timezone aware timestamps by their local time like the feeding times"""
+    timestamps = pd.DatetimeIndex(pd.to_datetime(timestamps))
+    if timestamps.tz is not None:
+        timestamps = timestamps.tz_localize(None)
+    return timestamps.values
+
+
+class FeedingSchedule:
+    """
+    The feeding events of a schedule file as arrays sorted by start: start and end (naive datetime64), the section of
+    the day, the number of the feeding of the day and whether it is a "ghost" feeding, i.e. added on a day without
+    feeding to make comparisons. Load it with FeedingSchedule.load, which parses every file once.
+    """
+
+    def __init__(self, feeding_times_data: dict, ghost_days=()):
+        """
+        :param feeding_times_data: Feeding times per day as in the json files, {"30.05.2023": [["08:00:00",
+        "08:15:00"]], ...}
+        :param ghost_days: Days (dd.mm.yyyy) whose feedings are ghost feedings
+        """
+        days = pd.to_datetime(list(feeding_times_data.keys()), format='%d.%m.%Y')
+        counts = np.array([len(events) for events in feeding_times_data.values()], dtype=np.int64)
+        times = [event for events in feeding_times_data.values() for event in events]
+        event_days = np.repeat(days.values, counts)
+        starts = event_days + pd.to_timedelta([event[0] for event in times]).values
+        ends = event_days + pd.to_timedelta([event[1] for event in times]).values
+        feeding_of_the_day = np.arange(len(times)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+        is_ghost = np.repeat(np.isin(list(feeding_times_data.keys()), list(ghost_days)), counts)
+        order = np.argsort(starts, kind="stable")
+        self.days = np.sort(days.values)
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.feeding_of_the_day = feeding_of_the_day[order]
+        self.is_ghost = is_ghost[order]
+        self.sections = assign_sections(self.starts)
+        # Ends in ascending order and their event positions, for the nearest end
+        self.end_order = np.argsort(self.ends, kind="stable")
+        self.sorted_ends = self.ends[self.end_order]
+        for values in (self.days, self.starts, self.ends, self.feeding_of_the_day, self.is_ghost, self.sections,
+                       self.end_order, self.sorted_ends):
+            values.setflags(write=False)
+
+    @classmethod
+    def load(cls, with_breaks: bool = True) -> "FeedingSchedule":
+        """
+        The schedule of one of the files of load_feeding_times, the same object as long as the file is unchanged
+        :param with_breaks: Whether the file with Fasting periods should be loaded or the one where "ghost" feeding
+        times are added to make comparisons (the feedings of the days that are empty in the other file)
+        """
+        path = ProjectConstants.FEEDING_TIMES_NO_BREAKS if with_breaks else ProjectConstants.FEEDING_TIMES
+        feeding_times_data = _read_feeding_times_data(path)
+        ghost_days = ()
+        if not with_breaks:
+            ghost_days = tuple(day for day, events in
+                               _read_feeding_times_data(ProjectConstants.FEEDING_TIMES_NO_BREAKS).items()
+                               if not events)
+        key = (id(feeding_times_data), ghost_days)
+        if key not in _SCHEDULES:
+            _SCHEDULES[key] = cls(feeding_times_data, ghost_days)
+        return _SCHEDULES[key]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def to_feeding_times_data(self) -> dict:
+        """The feeding times per day as in the json files"""
+        feeding_times_data = {day: [] for day in pd.DatetimeIndex(self.days).strftime('%d.%m.%Y')}
+        for day, start, end in zip(pd.DatetimeIndex(self.starts).strftime('%d.%m.%Y'),
+                                   pd.DatetimeIndex(self.starts).strftime('%H:%M:%S'),
+                                   pd.DatetimeIndex(self.ends).strftime('%H:%M:%S')):
+            feeding_times_data[day].append([start, end])
+        return feeding_times_data
+
+    def to_frame(self) -> pandas.DataFrame:
+        """The df of load_feeding_times, one row per day with the date and the list of [start, end] strings"""
+        feeding_times_df = pd.DataFrame([{'date': k, 'feeding_times': v}
+                                         for k, v in self.to_feeding_times_data().items()])
+        feeding_times_df["date"] = pd.to_datetime(feeding_times_df["date"], format='%d.%m.%Y').dt.date
+        return feeding_times_df
+
+    def fill_days_without_feeding(self) -> "FeedingSchedule":
+        """Schedule where every day without feeding repeats the feeding times of the last day with feeding as ghosts"""
+        feeding_times_data = {}
+        ghost_days = {day for day, is_ghost in zip(pd.DatetimeIndex(self.starts).strftime('%d.%m.%Y'), self.is_ghost)
+                      if is_ghost}
+        previous_events = None
+        for day, events in self.to_feeding_times_data().items():
+            if not events and previous_events is not None:
+                events = previous_events
+                ghost_days.add(day)
+            elif events:
+                previous_events = events
+            feeding_times_data[day] = events
+        return FeedingSchedule(feeding_times_data, ghost_days)
+
+    def event_slice(self, start=None, end=None) -> slice:
+        """Positions of the events starting in [start, end)"""
+        lower = 0 if start is None else np.searchsorted(self.starts, _wall_times([start])[0], side="left")
+        upper = len(self) if end is None else np.searchsorted(self.starts, _wall_times([end])[0], side="left")
+        return slice(int(lower), int(max(upper, lower)))
+
+    def events(self, start=None, end=None) -> pandas.DataFrame:
+        """The events starting in [start, end), one row per event"""
+        positions = self.event_slice(start, end)
+        return pd.DataFrame({"start": self.starts[positions],
+                             "end": self.ends[positions],
+                             "date": self.starts[positions].astype("datetime64[D]").astype("datetime64[ns]"),
+                             "section": self.sections[positions],
+                             "feeding_of_the_day": self.feeding_of_the_day[positions],
+                             "is_ghost": self.is_ghost[positions]})
+
+    def nearest(self, timestamps, on="start") -> np.ndarray:
+        """
+        Position of the event whose start (or end) is closest to each timestamp, the earlier one on ties (like
+        merge_asof(direction="nearest"))
+        """
+        if on not in ["start", "end"]:
+            raise AttributeError(f"Unknown event edge {on}, choose from ['start', 'end']")
+        edges = self.starts if on == "start" else self.sorted_ends
+        times = _wall_times(timestamps)
+        after = np.clip(np.searchsorted(edges, times, side="left"), 0, len(edges) - 1)
+        before = np.clip(np.searchsorted(edges, times, side="right") - 1, 0, len(edges) - 1)
+        is_after_closer = np.abs(edges[after] - times) < np.abs(times - edges[before])
+        positions = np.where(is_after_closer, after, before)
+        return positions if on == "start" else self.end_order[positions]
+
+    def time_to_feeding(self, timestamps) -> np.ndarray:
+        """
+        Signed time from the closest feeding to each timestamp (negative before it): the distance to the nearest
+        start or, if that is not closer, to the nearest end, and 0 inside [start, end] of the event with the nearest
+        start
+        :return: timedelta64 per timestamp
+        """
+        times = _wall_times(timestamps)
+        nearest_start = self.nearest(times, on="start")
+        distance_start = times - self.starts[nearest_start]
+        distance_end = times - self.ends[self.nearest(times, on="end")]
+        difference = np.where(np.abs(distance_start) < np.abs(distance_end), distance_start, distance_end)
+        is_inside = (times >= self.starts[nearest_start]) & (times <= self.ends[nearest_start])
+        return np.where(is_inside, np.timedelta64(0, "ns"), difference)
+
+    def is_inside(self, timestamps, before=pd.Timedelta(0), after=pd.Timedelta(0)) -> np.ndarray:
+        """Whether each timestamp lies in [start - before, end + after) of any feeding"""
+        times = _wall_times(timestamps)
+        window_starts = self.starts - pd.Timedelta(before).to_timedelta64()
+        # The latest end of all windows that started so far covers overlapping windows
+        window_ends = np.maximum.accumulate(self.ends + pd.Timedelta(after).to_timedelta64())
+        positions = np.searchsorted(window_starts, times, side="right") - 1
+        return (positions >= 0) & (times < window_ends[np.maximum(positions, 0)])
+
 
 def load_feeding_times(with_breaks: bool = True) -> pandas.DataFrame:
     """
@@ -16,39 +182,30 @@ def load_feeding_times(with_breaks: bool = True) -> pandas.DataFrame:
     "ghost" feeding times are added to make comparisons.
     :return:
     """
-    if with_breaks:
-        with open(ProjectConstants.FEEDING_TIMES_NO_BREAKS, 'r') as json_file:
-            feeding_times_data = json.load(json_file)
-    else:
-        with open(ProjectConstants.FEEDING_TIMES, 'r') as json_file:
-            feeding_times_data = json.load(json_file)
-    feeding_times_df = pd.DataFrame([{'date': k, 'feeding_times': v} for k, v in feeding_times_data.items()])
-    feeding_times_df["date"] = pd.to_datetime(feeding_times_df["date"], format='%d.%m.%Y').dt.date
-    return feeding_times_df
+    return FeedingSchedule.load(with_breaks).to_frame()
 
 
 def add_feeding_bars_discrete(fig: plotly.graph_objs.Figure, start_end_inclusive: List = None, y0=0, y1=1,
                               pause_hours_after_feeding=2,
                               verbose: bool = False, color="red") -> plotly.graph_objs.Figure:
     """Add Feeding bars under the time series graph to visualize when feeding happened"""
-    feeding_times = load_feeding_times()
+    schedule = FeedingSchedule.load()
     if start_end_inclusive:
-        feeding_times = feeding_times[
-            feeding_times["date"].between(start_end_inclusive[0], start_end_inclusive[1])]
-    for date in feeding_times["date"]:
-        for feeding_events_of_the_day in feeding_times.loc[feeding_times["date"] == date, "feeding_times"]:
-            for feeding_event in feeding_events_of_the_day:
-                if verbose:
-                    print(f"On {date}, feeding events was/were {feeding_event}")
-                fig.add_shape(
-                    type='rect',
-                    x0=dt.datetime.combine(date, dt.datetime.strptime(feeding_event[0], '%H:%M:%S').time()),
-                    x1=dt.datetime.combine(date, dt.datetime.strptime(feeding_event[1], '%H:%M:%S').time())
-                       + pd.Timedelta(hours=pause_hours_after_feeding),
-                    y0=y0,
-                    y1=y1,
-                    fillcolor=color,
-                    opacity=0.75,
-                    line_width=0
-                )
+        events = schedule.events(pd.Timestamp(start_end_inclusive[0]).normalize(),
+                                 pd.Timestamp(start_end_inclusive[1]).normalize() + pd.Timedelta(days=1))
+    else:
+        events = schedule.events()
+    for start, end in zip(events["start"], events["end"]):
+        if verbose:
+            print(f"On {start.date()}, feeding event was {start.time()} - {end.time()}")
+        fig.add_shape(
+            type='rect',
+            x0=start,
+            x1=end + pd.Timedelta(hours=pause_hours_after_feeding),
+            y0=y0,
+            y1=y1,
+            fillcolor=color,
+            opacity=0.75,
+            line_width=0
+        )
     return fig
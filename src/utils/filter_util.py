@@ -1,9 +1,12 @@
 import datetime
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
 from pandas import DataFrame, Timestamp
 
 from src.utils.project_constants import ProjectConstants
+from src.utils.resample_util import resample_mean
 
 
 def filter_by_snr(df: DataFrame, lower_bound_inclusive=25, upper_bound_exclusive=35):
@@ -13,11 +16,18 @@ def filter_by_snr(df: DataFrame, lower_bound_inclusive=25, upper_bound_exclusive
     return filtered_df
 
 
+def get_detection_times(df: DataFrame):
+    """The detection times of the rows, taken from the innermost index level in compact frames without datum"""
+    if "datum" in df.columns:
+        return df["datum"]
+    return df.index.get_level_values(-1)
+
+
 def cut_by_start_date(df: DataFrame, start_date: str, add_days=0):
     start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d")
     if add_days > 0:
         start_date = start_date - datetime.timedelta(days=add_days)
-    filtered_df = df[df["datum"] > Timestamp(start_date)]
+    filtered_df = df[get_detection_times(df) > Timestamp(start_date)]
     return filtered_df
 
 
@@ -27,7 +37,7 @@ def cut_by_end_date(df: DataFrame, end_date: str, include_end=True, add_days=0):
         end_date = end_date + datetime.timedelta(days=1)
     if add_days:
         end_date = end_date + datetime.timedelta(days=add_days)
-    filtered_df = df[df["datum"] < Timestamp(end_date)]
+    filtered_df = df[get_detection_times(df) < Timestamp(end_date)]
     return filtered_df
 
 
@@ -38,18 +48,50 @@ def assign_experiment_section(row):
     return 'No Section'
 
 
+@lru_cache(maxsize=None)
+def _compile_sections(sections: tuple):
+    """Split the (possibly overlapping) sections into sorted elementary intervals labelled by the first matching one"""
+    boundaries = np.array(sorted({bound for _, start, end in sections for bound in (start, end)}),
+                          dtype="datetime64[ns]")
+    labels = np.full(len(boundaries), 'No Section', dtype=object)  # last boundary opens the interval after all
+    for position in range(len(boundaries) - 1):
+        for section, start, end in sections:
+            if start <= boundaries[position] < end:
+                labels[position] = section
+                break
+    return boundaries, labels
+
+
+def assign_sections(timestamps) -> np.ndarray:
+    """
+    Vectorized assign_experiment_section, labels each timestamp with the section of its day
+    (first match in the order of EXPERIMENT_SECTIONS_DICT)
+    :param timestamps: Timestamps or dates, timezone aware ones are labelled by their local day
+    """
+    timestamps = pd.DatetimeIndex(pd.to_datetime(timestamps))
+    if timestamps.tz is not None:
+        timestamps = timestamps.tz_localize(None)
+    boundaries, labels = _compile_sections(tuple((section, pd.Timestamp(dates[0]), pd.Timestamp(dates[1]))
+                                                 for section, dates in
+                                                 ProjectConstants.EXPERIMENT_SECTIONS_DICT.items()))
+    days = timestamps.normalize().values
+    positions = np.searchsorted(boundaries, days, side="right") - 1
+    result = np.where(positions >= 0, labels[np.maximum(positions, 0)], 'No Section')
+    result[pd.isna(days)] = 'No Section'
+    return result
+
+
 def reduce_to_interpolated_values_with_sections_df(df, minutes, include_random_phases=False, data_type="activity"):
     if data_type == "activity":
         df = df.loc[df["is_activity"]]
     elif data_type == "temperature":
         df = df.loc[df["is_temperature"]]
-    df = df.reset_index(level=0)
-    df = df.resample(f'{minutes}min', label='left', closed='left',
-                     offset=f"{0}min",
-                     on="Time (corrected)").mean()  # STATS 0.1
+    # Compact frames keep the detection time only in the index
+    on = "Time (corrected)" if "Time (corrected)" in df.columns else None
+    df = resample_mean(df, minutes, [data_type], on=on).rename_axis("Time (corrected)")  # STATS 0.1
 
     df["date"] = df.index.date
-    df['section'] = df.apply(assign_experiment_section, axis=1)
+    df['section'] = assign_sections(df.index)
     if not include_random_phases:
         df = df.loc[(df["section"] != "Irregular Phase 1") & (df["section"] != "Irregular Phase 2")]
 
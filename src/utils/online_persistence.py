@@ -0,0 +1,204 @@
+import heapq
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+
+class _PendingPeak:
+    """A peak whose death is not known yet, with the lowest sample between it and its left barrier peak"""
+    __slots__ = ("born", "value", "saddle_left", "gap_min")
+
+    def __init__(self, born, value, saddle_left, gap_min):
+        self.born = born
+        self.value = value
+        # Lowest sample between the nearest higher pending peak on the left and this one (None if there is none)
+        self.saddle_left = saddle_left
+        # Lowest sample between this peak and the next pending peak (or the newest sample)
+        self.gap_min = gap_min
+
+
+class OnlinePersistenceTracker:
+    """
+    Incremental version of get_persistent_homology for a live feed, computed per day. Samples are ordered by value
+    and, for equal values, by position (earlier is higher), like the stable descending sort of the batch algorithm.
+    A peak dies at the lower of its two saddles: towards the nearest strictly higher sample on the left and towards
+    the nearest higher or equal sample on the right (its own plateau excluded). Pending peaks are kept on a stack
+    with decreasing values, so every sample costs amortized constant time (plus a binary search per death).
+    The peaks of a completed day equal get_persistent_homology of the values of that day.
+    """
+
+    def __init__(self, top_k=3):
+        """:param top_k: Number of peaks returned by current_top_k"""
+        self.top_k = top_k
+        self.completed_days = {}
+        self._day = None
+        self._reset()
+
+    def _reset(self):
+        self._times = []
+        self._values = []
+        self._stack = []
+        # Positions with a lower key than every later sample, the previous smaller chain of the newest sample
+        self._chain = []
+        self._chain_keys = []
+        self._candidate = None
+        self._peaks = []
+        self._top_dead = []
+        self._minimum = None
+
+    def _key(self, position):
+        # Higher key is processed earlier by the batch algorithm
+        return self._values[position], -position
+
+    def _event(self, kind, peak):
+        return {"event": kind, "day": self._day, "time": self._times[peak["born"]], **peak}
+
+    def _die(self, pending, died, left, right, events):
+        peak = {"born": pending.born, "left": left, "right": right, "value": pending.value, "died": died,
+                "persistence": pending.value - self._values[died]}
+        self._peaks.append(peak)
+        entry = (peak["persistence"], -pending.born, pending.born)
+        if len(self._top_dead) < self.top_k:
+            heapq.heappush(self._top_dead, entry)
+        elif entry > self._top_dead[0]:
+            heapq.heapreplace(self._top_dead, entry)
+        events.append(self._event("died", peak))
+
+    def _pop_into_below(self):
+        pending = self._stack.pop()
+        if self._stack and pending.gap_min is not None:
+            below = self._stack[-1]
+            if below.gap_min is None or self._key(pending.gap_min) < self._key(below.gap_min):
+                below.gap_min = pending.gap_min
+        return pending
+
+    def _push(self, born, gap_min, events):
+        saddle_left = self._stack[-1].gap_min if self._stack else None
+        self._stack.append(_PendingPeak(born, self._values[born], saddle_left, gap_min))
+        events.append({"event": "born", "day": self._day, "time": self._times[born], "born": born,
+                       "value": self._values[born]})
+
+    def update(self, timestamp, value) -> list:
+        """
+        Add the next sample of the feed, a sample of a new day completes the previous day first
+        :param timestamp: Time of the sample, samples must arrive in order
+        :param value: The sample, must not be NaN (interpolate first like the standard data)
+        :return: The born and died events caused by the sample
+        """
+        timestamp = pd.Timestamp(timestamp)
+        if np.isnan(value):
+            raise ValueError("NaN values cannot be ordered, interpolate the feed first")
+        events = []
+        if self._day is not None and timestamp.date() != self._day:
+            events.extend(self.finalize_day())
+        self._day = timestamp.date()
+        position = len(self._values)
+        self._times.append(timestamp)
+        self._values.append(value)
+        self._minimum = value if self._minimum is None else min(self._minimum, value)
+        key = self._key(position)
+
+        # A peak (first sample of a plateau reached from below) is confirmed once the plateau ends lower. A longer
+        # plateau that ends higher is a peak as well, it dies right away at its last sample with persistence 0.
+        if self._candidate is not None and value != self._values[self._candidate]:
+            last_of_plateau = position - 1
+            if value < self._values[self._candidate] or last_of_plateau > self._candidate:
+                self._push(self._candidate, last_of_plateau if last_of_plateau > self._candidate else None, events)
+            self._candidate = None if value < self._values[self._candidate] else position
+        elif self._candidate is None and (position == 0 or value > self._values[position - 1]):
+            self._candidate = position
+
+        # Pending peaks whose left saddle is higher than the new sample die at their left saddle
+        while self._stack and self._stack[-1].saddle_left is not None and self._key(
+                self._stack[-1].saddle_left) > key:
+            pending = self._pop_into_below()
+            self._die(pending, pending.saddle_left, pending.saddle_left + 1, position - 1, events)
+        # The new sample is the right barrier of all pending peaks that are not higher
+        while self._stack and self._stack[-1].value <= value and self._stack[-1].born < position - 1:
+            pending = self._pop_into_below()
+            # The component reaches left up to the nearest sample lower than the saddle
+            lower = bisect_left(self._chain_keys, self._key(pending.gap_min))
+            left = self._chain[lower - 1] + 1 if lower > 0 else 0
+            self._die(pending, pending.gap_min, left, pending.gap_min - 1, events)
+
+        if self._stack and (self._stack[-1].gap_min is None or key < self._key(self._stack[-1].gap_min)):
+            self._stack[-1].gap_min = position
+        while self._chain_keys and self._chain_keys[-1] > key:
+            self._chain.pop()
+            self._chain_keys.pop()
+        self._chain.append(position)
+        self._chain_keys.append(key)
+        return events
+
+    def current_top_k(self) -> pd.DataFrame:
+        """The most persistent peaks of the running day as if it ended now"""
+        candidates = [(persistence, -born, born) for persistence, _, born in self._top_dead]
+        for pending in self._stack:
+            lowest = self._minimum if pending.saddle_left is None else self._values[pending.saddle_left]
+            candidates.append((pending.value - lowest, -pending.born, pending.born))
+        top = heapq.nlargest(self.top_k, candidates)
+        return pd.DataFrame({"time": [self._times[born] for _, _, born in top],
+                             "born": [born for _, _, born in top],
+                             "value": [self._values[born] for _, _, born in top],
+                             "persistence": [persistence for persistence, _, _ in top]})
+
+    def finalize_day(self) -> list:
+        """
+        Complete the running day: pending peaks die at their left saddle, the highest one never dies.
+        The peaks table is stored in completed_days.
+        :return: The born and died events of the completion and a survived event for the highest peak
+        """
+        events = []
+        if self._day is None or not self._values:
+            return events
+        last = len(self._values) - 1
+        if self._candidate is not None:
+            self._push(self._candidate, last if last > self._candidate else None, events)
+        while self._stack:
+            pending = self._pop_into_below()
+            if pending.saddle_left is None:
+                peak = {"born": pending.born, "left": 0, "right": last, "value": pending.value, "died": -1,
+                        "persistence": pending.value - self._minimum}
+                self._peaks.append(peak)
+                events.append(self._event("survived", peak))
+            else:
+                self._die(pending, pending.saddle_left, pending.saddle_left + 1, last, events)
+        # Same row order (batch birth order) and sorting as get_persistent_homology
+        peaks = sorted(self._peaks, key=lambda peak: (-peak["value"], peak["born"]))
+        values = np.asarray(self._values)
+        peaks_df = pd.DataFrame({
+            "born": np.array([peak["born"] for peak in peaks], dtype=np.int64),
+            "left": np.array([peak["left"] for peak in peaks], dtype=np.int64),
+            "right": np.array([peak["right"] for peak in peaks], dtype=np.int64),
+            "value": values[[peak["born"] for peak in peaks]],
+            "died": np.array([peak["died"] for peak in peaks], dtype=np.int64),
+        })
+        died = peaks_df["died"].to_numpy()
+        peaks_df["persistence"] = np.where(died >= 0, peaks_df["value"].to_numpy() - values[np.maximum(died, 0)],
+                                           peaks_df["value"].to_numpy() - np.min(values))
+        self.completed_days[self._day] = peaks_df.sort_values(by="persistence", ascending=False)
+        self._reset()
+        return events
+
+
+if __name__ == "__main__":
+    import time
+
+    from src.utils.persistent_homology import get_persistent_homology
+
+    # Replay three days of a 10 minute feed and compare every completed day with the batch diagram
+    rng = np.random.default_rng(0)
+    feed = pd.Series(rng.gamma(2, 0.3, 3 * 144).round(2),
+                     index=pd.date_range("2023-06-02", periods=3 * 144, freq="10min"))
+    tracker = OnlinePersistenceTracker(top_k=3)
+    number_of_events = 0
+    start = time.perf_counter()
+    for timestamp, value in feed.items():
+        number_of_events += len(tracker.update(timestamp, value))
+    number_of_events += len(tracker.finalize_day())
+    print(f"{len(feed)} samples, {number_of_events} events in {time.perf_counter() - start:.3f}s")
+    for day, peaks_df in tracker.completed_days.items():
+        expected = get_persistent_homology(feed[feed.index.date == day].to_numpy())
+        pd.testing.assert_frame_equal(peaks_df.reset_index(drop=True), expected.reset_index(drop=True))
+        print(f"{day}: {len(peaks_df)} peaks equal to the batch result")
@@ -0,0 +1,94 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from src.utils.data_cache import cache_key, read_cached_df, write_cached_df
+from src.utils.persistent_homology import get_persistent_homology, get_segmented_persistent_homology
+
+
+def rank_peaks_within_day(peaks_df: pd.DataFrame) -> pd.DataFrame:
+    """Sort the peaks (indexed by time) by day and persistence, ties in order of appearance, and add the day rank"""
+    days = pd.factorize(peaks_df.index.normalize(), sort=True)[0]
+    order = np.lexsort((np.arange(len(peaks_df)), -peaks_df["persistence"].to_numpy(), days))
+    is_first_of_day = np.r_[True, days[order][1:] != days[order][:-1]]
+    first_position = np.maximum.accumulate(np.where(is_first_of_day, np.arange(len(order)), 0))
+    return peaks_df.iloc[order].assign(rank_within_day=(np.arange(len(order)) - first_position + 1).astype(str))
+
+
+class PersistenceIndex:
+    """
+    Persistent peaks of one series computed once and kept sorted per day by persistence, so that any threshold or
+    top-N selection is a binary search and a slice per day instead of a new diagram
+    """
+
+    def __init__(self, peaks_df: pd.DataFrame):
+        """:param peaks_df: Peaks indexed by time, sorted by day and persistence (see rank_peaks_within_day)"""
+        self.peaks_df = peaks_df
+        days = peaks_df.index.normalize()
+        self._day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(days) else np.array([], int)
+        self._day_ends = np.r_[self._day_starts[1:], len(peaks_df)].astype(np.int64)
+        self._negative_persistence = -peaks_df["persistence"].to_numpy()
+
+    @classmethod
+    def from_series(cls, series: pd.Series, segment_by_day=False):
+        """
+        :param series: Values indexed by time, e.g. df_act["activity"]
+        :param segment_by_day: Compute the persistence within every day instead of over the whole series
+        """
+        if segment_by_day:
+            peaks_df = get_segmented_persistent_homology(series, series.index.date).drop(columns=["segment", "rank"])
+        else:
+            peaks_df = get_persistent_homology(series)
+        peaks_df[series.name] = peaks_df["value"]
+        datetimes = series.reset_index().iloc[peaks_df["born"], 0]
+        peaks_df["Time (corrected)"] = pd.to_datetime(datetimes.values)
+        peaks_df = peaks_df.set_index(peaks_df["Time (corrected)"])
+        return cls(rank_peaks_within_day(peaks_df))
+
+    def _selected_positions(self, threshold, top_n) -> np.ndarray:
+        counts = np.array([np.searchsorted(self._negative_persistence[start:end], -threshold, side="left")
+                           for start, end in zip(self._day_starts, self._day_ends)], dtype=np.int64)
+        counts = np.minimum(counts, top_n) if top_n is not None else counts
+        if counts.sum() == 0:
+            return np.array([], dtype=np.int64)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(self._day_starts, counts) + offsets
+
+    def query(self, threshold=0, top_n=3) -> pd.DataFrame:
+        """
+        Peaks with a persistence above the threshold, at most top_n per day (all if None),
+        same as calculate_persistence(df, top_n, threshold)
+        """
+        return self.peaks_df.iloc[self._selected_positions(threshold, top_n)]
+
+    def sweep(self, thresholds, top_ns) -> pd.DataFrame:
+        """Selected peaks of every combination of threshold and top_n in one long table"""
+        positions = []
+        settings = []
+        for threshold in thresholds:
+            for top_n in top_ns:
+                selected = self._selected_positions(threshold, top_n)
+                positions.append(selected)
+                settings.append(np.repeat([[threshold, np.nan if top_n is None else top_n]], len(selected), axis=0))
+        positions = np.concatenate(positions) if positions else np.array([], dtype=np.int64)
+        settings = np.concatenate(settings) if settings else np.empty((0, 2))
+        result = self.peaks_df.iloc[positions].reset_index(drop=True)
+        result.insert(0, "threshold", settings[:, 0])
+        result.insert(1, "top_n", settings[:, 1])
+        return result
+
+
+def load_persistence_index(series: pd.Series, segment_by_day=False, use_cache=True) -> PersistenceIndex:
+    """Persistence index of the series, read from or written to the data cache keyed by the series content"""
+    if not use_cache:
+        return PersistenceIndex.from_series(series, segment_by_day=segment_by_day)
+    content = hashlib.sha1(pd.util.hash_pandas_object(series).to_numpy().tobytes()).hexdigest()
+    parameters = {"series": str(series.name), "content": content, "segment_by_day": segment_by_day}
+    key = cache_key("persistence_index", content, **parameters)
+    peaks_df = read_cached_df(key)
+    if peaks_df is not None:
+        return PersistenceIndex(peaks_df)
+    index = PersistenceIndex.from_series(series, segment_by_day=segment_by_day)
+    write_cached_df(index.peaks_df, key, "persistence_index", parameters)
+    return index
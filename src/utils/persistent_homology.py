@@ -37,7 +37,125 @@ class Peak:
         return -1 if self.died is None else seq[self.born] - seq[self.died]
 
 
+def _process_descending(values: list, order: list, connected: list = None):
+    """
+    Grow the components in the given order, returning born, left, right and died (-1 if never) per peak.
+    Only the two ends of a component are ever looked up as neighbours, so only they carry the peak label.
+    :param connected: Whether position i and i + 1 may merge, all by default (segment barriers otherwise)
+    """
+    length = len(values)
+    connected = [True] * max(length - 1, 0) if connected is None else connected
+    idx_to_peak = [-1] * length
+    born, left, right, died = [], [], [], []
+    born_values = []
+    for idx in order:
+        il = idx_to_peak[idx - 1] if idx > 0 and connected[idx - 1] else -1
+        ir = idx_to_peak[idx + 1] if idx < length - 1 and connected[idx] else -1
+        if il < 0 and ir < 0:
+            # New peak born
+            idx_to_peak[idx] = len(born)
+            born.append(idx)
+            left.append(idx)
+            right.append(idx)
+            died.append(-1)
+            born_values.append(values[idx])
+        elif ir < 0:
+            # Directly merge to next peak left
+            right[il] += 1
+            idx_to_peak[idx] = il
+        elif il < 0:
+            # Directly merge to next peak right
+            left[ir] -= 1
+            idx_to_peak[idx] = ir
+        elif born_values[il] > born_values[ir]:
+            # Left was born earlier: merge right to left
+            died[ir] = idx
+            right[il] = right[ir]
+            idx_to_peak[right[il]] = idx_to_peak[idx] = il
+        else:
+            died[il] = idx
+            left[ir] = left[il]
+            idx_to_peak[left[ir]] = idx_to_peak[idx] = ir
+    return born, left, right, died
+
+
+def _descending_order(values: np.ndarray) -> np.ndarray:
+    """Positions descending by value, ties in ascending position (like the stable sorted(..., reverse=True))"""
+    return len(values) - 1 - np.argsort(values[::-1], kind="stable")[::-1]
+
+
 def get_persistent_homology(seq):
+    """
+    0-dimensional persistence of the maxima of the sequence, same peaks table as get_persistent_homology_reference
+    :param seq: Values by position (Series or array)
+    :return: df with born, left, right, value, died and persistence per peak, sorted by persistence
+    """
+    values = np.asarray(seq)
+    born, left, right, died = _process_descending(values.tolist(), _descending_order(values).tolist())
+    born = np.array(born, dtype=np.int64)
+    died = np.array(died, dtype=np.int64)
+    peak_values = values[born]
+    peaks_df = pd.DataFrame({
+        'born': born,
+        'left': np.array(left, dtype=np.int64),
+        'right': np.array(right, dtype=np.int64),
+        'value': peak_values,
+        'died': died
+    })
+    # The peak that never dies persists down to the global minimum
+    peaks_df["persistence"] = np.where(died >= 0, peak_values - values[np.maximum(died, 0)],
+                                       peak_values - np.min(seq))
+    return peaks_df.sort_values(by="persistence", ascending=False)
+
+
+def get_segmented_persistent_homology(seq, segments):
+    """
+    Persistence of every segment (e.g. day, fish or fish and day) in one sorted pass, components never grow over a
+    segment boundary and the peak that never dies persists down to the minimum of its segment
+    :param seq: Values by position (Series or array)
+    :param segments: Segment label per position, every segment must be contiguous
+    :return: Peaks table like get_persistent_homology plus segment and rank (by persistence within the segment),
+    sorted by segment (in order of appearance) and rank
+    """
+    values = np.asarray(seq)
+    codes, labels = pd.factorize(np.asarray(segments))
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], dtype=np.int64)
+    if len(np.unique(codes)) != len(starts):
+        raise ValueError("Segments must be contiguous")
+    connected = (codes[1:] == codes[:-1]).tolist()
+    born, left, right, died = _process_descending(values.tolist(), _descending_order(values).tolist(), connected)
+    born = np.array(born, dtype=np.int64)
+    died = np.array(died, dtype=np.int64)
+    peak_values = values[born]
+    peak_segments = codes[born]
+    segment_minima = np.minimum.reduceat(values, starts) if len(starts) else values[:0]
+    persistence = np.where(died >= 0, peak_values - values[np.maximum(died, 0)],
+                           peak_values - segment_minima[peak_segments])
+    # Sort by segment, then persistence (descending), then birth order
+    order = np.lexsort((np.arange(len(born)), -persistence, peak_segments))
+    sorted_segments = peak_segments[order]
+    is_first = np.r_[True, sorted_segments[1:] != sorted_segments[:-1]]
+    first_position = np.maximum.accumulate(np.where(is_first, np.arange(len(order)), 0))
+    peaks_df = pd.DataFrame({
+        'born': born[order],
+        'left': np.array(left, dtype=np.int64)[order],
+        'right': np.array(right, dtype=np.int64)[order],
+        'value': peak_values[order],
+        'died': died[order],
+        'persistence': persistence[order],
+        'segment': labels[sorted_segments],
+        'rank': np.arange(len(order)) - first_position + 1
+    })
+    return peaks_df
+
+
+def top_k_per_segment(peaks_df: pd.DataFrame, k: int) -> pd.DataFrame:
+    """The k most persistent peaks of every segment of get_segmented_persistent_homology"""
+    return peaks_df.loc[peaks_df["rank"] <= k]
+
+
+def get_persistent_homology_reference(seq):
+    """Original implementation with one Peak object per maximum, kept as reference for the benchmark"""
     # Some changes to the code :D
 
     peaks = []
@@ -95,3 +213,20 @@ def get_persistent_homology(seq):
         peak.get_persistence(seq) if peak.get_persistence(seq) != -1 else peak.value - np.min(seq) for
         peak in peaks]
     return peaks_df.sort_values(by="persistence", ascending=False)
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    for length in [10 ** 5, 10 ** 6, 10 ** 7]:
+        seq = pd.Series(rng.normal(size=length).cumsum())
+        start = time.perf_counter()
+        peaks_df = get_persistent_homology(seq)
+        duration = time.perf_counter() - start
+        message = f"{length} samples, {len(peaks_df)} peaks: array engine {duration:.2f}s"
+        if length <= 10 ** 5:
+            start = time.perf_counter()
+            pd.testing.assert_frame_equal(peaks_df, get_persistent_homology_reference(seq))
+            message += f", reference {time.perf_counter() - start:.2f}s (identical)"
+        print(message)
@@ -19,6 +19,10 @@ class ProjectConstants():
     PLOTS = SRC.joinpath("plots")
     STATISTICS = SRC.joinpath("statistics")
     CAMERA_DATA = YEAR_2023.joinpath("Camera Speed Data")
+    CACHE = DATA.joinpath("cache")
+    CACHE_MAX_BYTES: Final = 512 * 1024 ** 2
+
+    TRANSMITTER_TIMESTAMP_FORMAT: Final = "%Y-%m-%d %H:%M:%S"
 
     START_OF_EXPERIMENT = pd.Timestamp(2023, 5, 2)  # Tag activation
     FISH_EXPERIMENT_SECTION_1 = pd.Timestamp(2023, 6, 2)  # Experiment protocol started
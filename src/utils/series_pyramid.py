@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+from src.utils.data_cache import cache_key, fingerprint_source_files, read_cached_df, write_cached_df
+from src.utils.data_loader import load_standard_detections
+from src.utils.filter_util import get_detection_times
+from src.utils.project_constants import ProjectConstants
+
+# Bin widths in minutes, each one is a multiple of a finer one and divides a day
+PYRAMID_RESOLUTIONS = [1, 5, 10, 20, 30, 60]
+# Variable and the boolean column selecting its rows (None for all rows), as in reduce_to_interpolated_values...
+PYRAMID_VARIABLES = {"activity": "is_activity", "temperature": "is_temperature", "Depth [m] (est. or from tag)": None}
+
+
+def build_series_pyramid(df: pd.DataFrame, variables: dict = None) -> dict:
+    """
+    Sum and count of every variable per bin for all PYRAMID_RESOLUTIONS. The finest level is built in one pass over
+    the detections on a grid of whole days, every coarser level is the exact sum of consecutive bins of a finer one.
+    :param df: Detections with the timestamps in the datum column or the innermost index level
+    :return: Dict of minutes to df indexed by the left bin edges with the columns "<variable> sum|count"
+    """
+    variables = PYRAMID_VARIABLES if variables is None else variables
+    timestamps = pd.DatetimeIndex(get_detection_times(df))
+    if timestamps.tz is not None:
+        timestamps = timestamps.tz_localize(None)
+    finest = PYRAMID_RESOLUTIONS[0]
+    start = timestamps.min().normalize()
+    number_of_days = (timestamps.max().normalize() - start).days + 1
+    number_of_bins = number_of_days * 24 * 60 // finest
+    bins = (timestamps.asi8 - start.value) // pd.Timedelta(minutes=finest).value
+
+    columns = {}
+    for variable, selection in variables.items():
+        values = df[variable].to_numpy(dtype=np.float64)
+        is_used = ~np.isnan(values)
+        if selection is not None:
+            is_used &= df[selection].to_numpy()
+        columns[f"{variable} sum"] = np.bincount(bins[is_used], weights=values[is_used], minlength=number_of_bins)
+        columns[f"{variable} count"] = np.bincount(bins[is_used], minlength=number_of_bins)
+    index = pd.date_range(start, periods=number_of_bins, freq=f"{finest}min", name="Time (corrected)")
+    pyramid = {finest: pd.DataFrame(columns, index=index)}
+    for minutes in PYRAMID_RESOLUTIONS[1:]:
+        finer = max(resolution for resolution in pyramid if minutes % resolution == 0)
+        factor = minutes // finer
+        finer_df = pyramid[finer]
+        pyramid[minutes] = pd.DataFrame(
+            {column: finer_df[column].to_numpy().reshape(-1, factor).sum(axis=1) for column in finer_df.columns},
+            index=finer_df.index[::factor].rename("Time (corrected)"))
+        pyramid[minutes].index.freq = f"{minutes}min"
+    return pyramid
+
+
+def _pyramid_parameters(minutes, with_dates, start_date, end_date, snr_slider_values, compact) -> dict:
+    return {"minutes": minutes, "with_dates": with_dates, "start_date": start_date, "end_date": end_date,
+            "snr_slider_values": list(snr_slider_values), "compact": compact,
+            "window": [ProjectConstants.FISH_EXPERIMENT_SECTION_1,
+                       ProjectConstants.END_OF_EXPERIMENT_PERIOD_PAPER_EXCLUSIVE],
+            "variables": PYRAMID_VARIABLES}
+
+
+def load_pyramid_level(minutes: int, with_dates=True, n_workers=1, start_date="2023-06-02", end_date="2023-07-20",
+                       snr_slider_values=(20, 100000), compact=False) -> pd.DataFrame:
+    """
+    One level of the pyramid of the standard detections, read from the cache. On a miss the whole pyramid is
+    built from the detections and every level is written to the cache.
+    """
+    if minutes not in PYRAMID_RESOLUTIONS:
+        raise AttributeError(f"{minutes} minutes is not part of the pyramid {PYRAMID_RESOLUTIONS}")
+    sources = fingerprint_source_files()
+    keys = {resolution: cache_key("series_pyramid", sources,
+                                  **_pyramid_parameters(resolution, with_dates, start_date, end_date,
+                                                        snr_slider_values, compact))
+            for resolution in PYRAMID_RESOLUTIONS}
+    df = read_cached_df(keys[minutes])
+    if df is not None:
+        df.index.freq = f"{minutes}min"
+        return df
+    print("Building the series pyramid...")
+    detections = load_standard_detections(with_dates=with_dates, n_workers=n_workers, start_date=start_date,
+                                          end_date=end_date, snr_slider_values=snr_slider_values, compact=compact)
+    pyramid = build_series_pyramid(detections)
+    for resolution, level_df in pyramid.items():
+        write_cached_df(level_df, keys[resolution], "series_pyramid",
+                        _pyramid_parameters(resolution, with_dates, start_date, end_date, snr_slider_values,
+                                            compact))
+    return pyramid[minutes]
+
+
+def pyramid_level_to_mean(level_df: pd.DataFrame, data_type="activity") -> pd.DataFrame:
+    """
+    Mean per bin of one variable, cut to the first and last bin with values like resample().mean() on its rows
+    """
+    counts = level_df[f"{data_type} count"].to_numpy()
+    filled = np.flatnonzero(counts)
+    if len(filled) == 0:
+        return pd.DataFrame({data_type: []}, index=level_df.index[:0])
+    level_df = level_df.iloc[filled[0]:filled[-1] + 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = level_df[f"{data_type} sum"].to_numpy() / level_df[f"{data_type} count"].to_numpy()
+    df = pd.DataFrame({data_type: mean}, index=level_df.index)
+    df.index.freq = level_df.index.freq
+    return df
+
+
+if __name__ == "__main__":
+    df_act = pyramid_level_to_mean(load_pyramid_level(20), data_type="activity")
+    print(df_act.head())
+    print(f"Activity at 20 minutes ({len(df_act)}) from the pyramid")
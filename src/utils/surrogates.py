@@ -0,0 +1,110 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import fft
+
+from src.utils.correlation_util import cross_correlation
+
+SURROGATE_METHODS = ["iaaft", "circular_shift"]
+
+
+def circular_shift_surrogates(x, n_surrogates: int, rng: np.random.Generator, min_shift=None) -> np.ndarray:
+    """
+    Rotations of the series by random shifts, keeping its whole autocorrelation but breaking the alignment
+    :param min_shift: Smallest shift in samples (both directions), by default a tenth of the length
+    :return: Array shaped (n_surrogates, n)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    length = len(x)
+    min_shift = max(length // 10, 1) if min_shift is None else min_shift
+    shifts = rng.integers(min_shift, max(length - min_shift, min_shift + 1), size=n_surrogates)
+    positions = (np.arange(length)[None, :] - shifts[:, None]) % length
+    return x[positions]
+
+
+def iaaft_surrogates(x, n_surrogates: int, rng: np.random.Generator, n_iterations=100) -> np.ndarray:
+    """
+    Iterative amplitude adjusted Fourier transform surrogates: random permutations of the series, then alternately
+    impose the amplitude spectrum and the value distribution of the series until the ranks stop changing (at most
+    n_iterations times), all surrogates as one batch
+    :return: Array shaped (n_surrogates, n) with exactly the values of the series
+    """
+    x = np.asarray(x, dtype=np.float64)
+    length = len(x)
+    sorted_values = np.sort(x)
+    amplitudes = np.abs(fft.rfft(x))
+    surrogates = np.stack([rng.permutation(x) for _ in range(n_surrogates)])
+    order = np.argsort(surrogates, axis=1)
+    # Only the surrogates whose ranks still change are iterated
+    active = np.arange(n_surrogates)
+    for _ in range(n_iterations):
+        spectra = fft.rfft(surrogates[active], axis=1)
+        adjusted = fft.irfft(amplitudes * np.exp(1j * np.angle(spectra)), n=length, axis=1)
+        new_order = np.argsort(adjusted, axis=1)
+        # The value of rank r goes to the position of the r-th smallest sample
+        np.put_along_axis(adjusted, new_order, sorted_values[None, :], axis=1)
+        surrogates[active] = adjusted
+        is_changed = np.any(new_order != order[active], axis=1)
+        order[active] = new_order
+        active = active[is_changed]
+        if len(active) == 0:
+            break
+    return surrogates
+
+
+def _surrogate_correlations(x, y, max_lag, method, seed_sequence, n_surrogates) -> np.ndarray:
+    """Cross-correlation of n_surrogates surrogates of x with y, shaped (n_surrogates, lags)"""
+    rng = np.random.default_rng(seed_sequence)
+    if method == "iaaft":
+        surrogates = iaaft_surrogates(x, n_surrogates, rng)
+    else:
+        surrogates = circular_shift_surrogates(x, n_surrogates, rng)
+    _, correlation = cross_correlation(surrogates.T, y, max_lag=max_lag, use_cache=False)
+    return correlation[:, :, 0].T
+
+
+def surrogate_confidence_bands(x, y, max_lag: int, n_surrogates=1000, method="iaaft", conf=0.95, seed=0,
+                               n_workers=1, batch_size=100) -> pd.DataFrame:
+    """
+    Per lag significance bands of the cross-correlation of x and y: the empirical quantiles of the cross-correlation
+    of surrogates of x (which keep its autocorrelation) with y. Every batch draws from its own child of one
+    SeedSequence, so the bands only depend on the seed, not on the number of workers.
+    :param method: "iaaft" (phase randomised, same spectrum and values) or "circular_shift"
+    :param n_workers: Number of processes for the batches, 1 computes them serially
+    :return: df indexed by lag with the lower and upper band
+    """
+    if method not in SURROGATE_METHODS:
+        raise AttributeError(f"Unknown surrogate method {method}, choose from {SURROGATE_METHODS}")
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    batch_sizes = [batch_size] * (n_surrogates // batch_size) + ([n_surrogates % batch_size] if n_surrogates %
+                                                                                                 batch_size else [])
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    arguments = ([x] * len(batch_sizes), [y] * len(batch_sizes), [max_lag] * len(batch_sizes),
+                 [method] * len(batch_sizes), seed_sequences, batch_sizes)
+    if n_workers is None or n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            correlations = np.concatenate(list(executor.map(_surrogate_correlations, *arguments)))
+    else:
+        correlations = np.concatenate(list(map(_surrogate_correlations, *arguments)))
+    lags = np.arange(-min(max_lag, len(x) - 1), min(max_lag, len(x) - 1) + 1)
+    lower, upper = np.quantile(correlations, [(1 - conf) / 2, (1 + conf) / 2], axis=0)
+    return pd.DataFrame({"lower": lower, "upper": upper}, index=pd.Index(lags, name="lag"))
+
+
+if __name__ == "__main__":
+    import time
+
+    # Two independent, strongly autocorrelated daily cycles: the white noise line marks many lags as significant
+    rng = np.random.default_rng(0)
+    t = np.arange(30 * 144)
+    x = np.sin(2 * np.pi * t / 144) + 0.3 * rng.normal(size=len(t)).cumsum() / 10
+    y = np.sin(2 * np.pi * (t - 20) / 144 + rng.normal()) + rng.gamma(2, 0.3, len(t))
+    for method in SURROGATE_METHODS:
+        start = time.perf_counter()
+        bands = surrogate_confidence_bands(x, y, max_lag=144, n_surrogates=500, method=method, n_workers=1)
+        print(f"{method}: 500 surrogates in {time.perf_counter() - start:.2f}s, "
+              f"upper band at lag 0: {bands.loc[0, 'upper']:.3f} (white noise line {1.96 / np.sqrt(len(t)):.3f})")
+    assert bands.equals(surrogate_confidence_bands(x, y, max_lag=144, n_surrogates=500, method=method, n_workers=2))
+    print("Same bands with two workers")
@@ -1,56 +1,142 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 
 from src.utils.project_constants import ProjectConstants
 
+# Raw csv columns needed downstream, the only ones read in compact mode
+COMPACT_CSV_COLUMNS = ["Date and Time (UTC)", "Name", "Id", "SNR", "Depth (Data 1)", "Temperature / RMS (Data 2)",
+                       "Data 2 unit"]
+
+
+def read_transmitter_csv_file(file, compact=False) -> pd.DataFrame:
+    """Read one transmitter csv file and index it by the corrected (local) detection time"""
+    if compact:
+        df = pd.read_csv(file, header=0, skipinitialspace=True, usecols=COMPACT_CSV_COLUMNS,
+                         dtype={"Name": "category", "Data 2 unit": "category"})
+    else:
+        df = pd.read_csv(file, header=0, skipinitialspace=True)
+    return index_transmitter_df(df, compact=compact)
+
+
+def index_transmitter_df(df: pd.DataFrame, compact=False) -> pd.DataFrame:
+    """
+    Parse the detection times once with a fixed format and add the derived columns of the datasheet
+    :param compact: Keep the timestamp only as index and rename the raw columns instead of copying them
+    """
+    try:
+        timestamps = pd.to_datetime(df["Date and Time (UTC)"], format=ProjectConstants.TRANSMITTER_TIMESTAMP_FORMAT)
+    except ValueError:
+        # Fall back to format inference for exports that deviate from the standard format
+        timestamps = pd.to_datetime(df["Date and Time (UTC)"])
+    timestamps = timestamps + pd.DateOffset(hours=3)  # Crete is +3 towards UTC!
+    datetime_index = pd.DatetimeIndex(timestamps.values)
+    is_in_experiment = (ProjectConstants.START_OF_EXPERIMENT <= datetime_index) & (
+            datetime_index <= ProjectConstants.END_OF_EXPERIMENT_INCLUSIVE)
+    if compact:
+        df = df.drop(columns=["Date and Time (UTC)"])
+        df.index = datetime_index
+        return df[is_in_experiment].rename(
+            columns={"SNR": "SNR [dB]", "Id": "ID", "Depth (Data 1)": "Depth [m] (est. or from tag)"})
+    df["time_index"] = timestamps
+    df["Time (corrected)"] = timestamps
+    df["datum"] = datetime_index
+    df.index = datetime_index
+    df = df[is_in_experiment].copy()
+    df["SNR [dB]"] = df["SNR"]
+    df["ID"] = df["Id"]
+    df["Depth [m] (est. or from tag)"] = df["Depth (Data 1)"]
+    return df
+
+
+def get_fish_numbers(names) -> dict:
+    """
+    Map every tag name to the number of its fish. The two tags of a fish have consecutive IDs and the fish number is
+    the higher one, names are paired in sorted order and a name is only skipped if it already has a fish number.
+    """
+    names = set(names)
+    fish_numbers = {}
+    for name in sorted(names):
+        identifier = int(name.split("-")[1])
+        if name not in fish_numbers:
+            other_name = name.split("-")[0] + "-" + str(identifier + 1)
+            fish_numbers[name] = identifier + 1
+            if other_name in names:
+                fish_numbers[other_name] = identifier + 1
+    return fish_numbers
+
+
+@lru_cache(maxsize=None)
+def _tag_pair_table(names: tuple) -> pd.DataFrame:
+    fish_numbers = get_fish_numbers(names)
+    tags = pd.DataFrame({"Name": list(fish_numbers.keys()), "fish_number": list(fish_numbers.values())})
+    # For all ODD number IDs the tag is carrying acceleration data, for all EVEN number IDs temperature data
+    tags["kind"] = np.where(tags["Name"].str.split("-").str[1].astype(int) % 2 == 1, "activity_tag",
+                            "temperature_tag")
+    pairs = tags.pivot_table(index="fish_number", columns="kind", values="Name", aggfunc="first")
+    return pairs.reindex(columns=["activity_tag", "temperature_tag"]).rename_axis(columns=None).reset_index()
+
+
+def get_tag_pairs(names=None) -> pd.DataFrame:
+    """
+    Table of the activity and the temperature tag of each fish, cached per set of tag names
+    :param names: The tag names, by default the ones of all transmitter csv files
+    """
+    if names is None:
+        names = [file.stem for file in ProjectConstants.CONSTRAINED_TRANSMITTER_DATA.glob("*.csv")]
+    return _tag_pair_table(tuple(sorted(set(names)))).copy()
+
+
+def concat_with_shared_categories(frames: dict) -> pd.DataFrame:
+    """Concatenate per file frames, unifying categorical columns first so they stay categorical"""
+    dfs = list(frames.values())
+    categorical_columns = [column for column in dfs[0].columns
+                           if isinstance(dfs[0][column].dtype, pd.CategoricalDtype)] if dfs else []
+    for column in categorical_columns:
+        categories = pd.api.types.union_categoricals([df[column] for df in dfs]).categories
+        dfs = [df.assign(**{column: df[column].cat.set_categories(categories)}) for df in dfs]
+    return pd.concat(dfs, keys=frames.keys(), names=["fish_name", "dates"])
+
 
 class TransmitterDataSheet:
-    def __init__(self, empty=False):
+    def __init__(self, empty=False, n_workers=1, compact=False):
+        """
+        :param empty: Whether to start without any loaded csv file
+        :param n_workers: Number of processes to read the csv files with, 1 reads them serially
+        :param compact: Read only the needed columns with categorical tag names and a single timestamp (the index)
+        """
         self._csv_files = {}
+        self._compact = compact
         if not empty:
-            self._add_all_csv_files()
+            self._add_all_csv_files(n_workers=n_workers)
 
-    def _add_all_csv_files(self):
-        iterator = ProjectConstants.CONSTRAINED_TRANSMITTER_DATA.glob('*.csv')
-        for file in iterator:
-            self.add_one_csv_file(file)
+    def _add_all_csv_files(self, n_workers=1):
+        files = list(ProjectConstants.CONSTRAINED_TRANSMITTER_DATA.glob('*.csv'))
+        if n_workers is None or n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                for file, df in zip(files, executor.map(read_transmitter_csv_file, files,
+                                                        [self._compact] * len(files))):
+                    self._csv_files[file.stem] = df
+        else:
+            for file in files:
+                self.add_one_csv_file(file)
 
     def add_one_csv_file(self, file):
-        df_indexed = pd.read_csv(file, header=0, skipinitialspace=True)
-        df_indexed["time_index"] = pd.to_datetime(df_indexed["Date and Time (UTC)"]) + pd.DateOffset(
-            hours=3)  # Crete is +3 towards UTC!
-        df_indexed["Time (corrected)"] = pd.to_datetime(df_indexed["Date and Time (UTC)"]) + pd.DateOffset(
-            hours=3)  # Crete is +3 towards UTC!
-        df_indexed = df_indexed.set_index(df_indexed["time_index"])
-        datetime_series = pd.to_datetime(df_indexed.index)
-        datetime_index = pd.DatetimeIndex(datetime_series.values)
-        df_indexed["datum"] = datetime_index
-        df_indexed_datetime = df_indexed.set_index(datetime_index)
-        df_indexed_datetime = df_indexed_datetime[
-                              ProjectConstants.START_OF_EXPERIMENT:
-                              ProjectConstants.END_OF_EXPERIMENT_INCLUSIVE]
-        df_indexed_datetime["SNR [dB]"] = df_indexed_datetime["SNR"]
-        df_indexed_datetime.drop(columns=["SNR"])
-        df_indexed_datetime["ID"] = df_indexed_datetime["Id"]
-        df_indexed_datetime.drop(columns=["Id"])
-        df_indexed_datetime["Depth [m] (est. or from tag)"] = df_indexed_datetime["Depth (Data 1)"]
-        df_indexed_datetime.drop(columns=["Depth (Data 1)"])
-        self._csv_files[file.stem] = df_indexed_datetime
+        self._csv_files[file.stem] = read_transmitter_csv_file(file, compact=self._compact)
 
     def get_all_current_csv_files_as_one_df(self):
-        df = pd.concat(self._csv_files.values(), keys=self._csv_files.keys(), names=["fish_name", "dates"])
+        if self._compact:
+            df = concat_with_shared_categories(self._csv_files)
+        else:
+            df = pd.concat(self._csv_files.values(), keys=self._csv_files.keys(), names=["fish_name", "dates"])
         df = self.add_fish_numbers(df)
         return df
 
     def add_fish_numbers(self, df):
         """Add unique ID to each fish (two tag numbers per fish)"""
-        df["fish_number"] = -1
-        for name in sorted(set(df["Name"])):
-            identifier = int(name.split("-")[1])
-            other_name = name.split("-")[0] + "-" + str(identifier + 1)
-            if (df.loc[df["Name"] == name, "fish_number"] == -1).all():
-                try:
-                    df.loc[df["Name"] == name, "fish_number"] = identifier + 1
-                    df.loc[df["Name"] == other_name, "fish_number"] = identifier + 1
-                except ValueError:
-                    pass
+        codes, names = pd.factorize(df["Name"])
+        fish_numbers = get_fish_numbers(names)
+        df["fish_number"] = np.array([fish_numbers[name] for name in names], dtype=np.int64)[codes]
         return df
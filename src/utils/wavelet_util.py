@@ -0,0 +1,225 @@
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil, floor
+
+import numpy as np
+import pywt
+from scipy import fft
+from scipy.signal import lfilter
+
+from src.utils.correlation_util import autocorrelation
+
+# Time domain kernels by wavelet and scale set, their spectra are computed per chunk
+_KERNEL_CACHE = OrderedDict()
+_KERNEL_CACHE_SIZE = 4
+
+
+def _scaled_kernels(wavelet: pywt.ContinuousWavelet, scales) -> list:
+    """The integrated wavelet sampled per scale and reversed, exactly as pywt.cwt convolves it"""
+    int_psi, x = pywt.integrate_wavelet(wavelet, precision=10)
+    int_psi = np.conj(int_psi) if wavelet.complex_cwt else int_psi
+    step = x[1] - x[0]
+    kernels = []
+    for scale in scales:
+        j = (np.arange(scale * (x[-1] - x[0]) + 1) / (scale * step)).astype(int)
+        kernels.append(int_psi[j[j < int_psi.size]][::-1])
+    return kernels
+
+
+def _cached_kernels(wavelet: pywt.ContinuousWavelet, scales) -> list:
+    """_scaled_kernels, cached per scale set"""
+    key = (wavelet.name, tuple(np.asarray(scales).tolist()))
+    if key not in _KERNEL_CACHE:
+        _KERNEL_CACHE[key] = _scaled_kernels(wavelet, scales)
+        if len(_KERNEL_CACHE) > _KERNEL_CACHE_SIZE:
+            _KERNEL_CACHE.popitem(last=False)
+    _KERNEL_CACHE.move_to_end(key)
+    return _KERNEL_CACHE[key]
+
+
+def _nan_windows(nan_cumsum: np.ndarray, kernel_length: int) -> np.ndarray:
+    """Whether each sample of the full convolution with a kernel of the given length involves a NaN"""
+    length = len(nan_cumsum) - 1
+    ends = np.minimum(np.arange(1, length + kernel_length), length)
+    starts = np.maximum(np.arange(1, length + kernel_length) - kernel_length, 0)
+    return nan_cumsum[ends] - nan_cumsum[starts] > 0
+
+
+def iter_cwt_chunks(data, scales, wavelet="morl", chunk_size=32, dtype=np.float32):
+    """
+    pywt.cwt (method "conv") by convolution in the frequency domain, a chunk of scales at a time. The data is
+    transformed once, the kernels come from a cache and are transformed per chunk (real FFTs for real wavelets), so
+    only chunk_size spectra exist at once. Like np.convolve, coefficients whose kernel window covers a NaN are NaN.
+    :return: Generator of (slice of the scales, coefficients of the chunk in dtype, complex for complex wavelets)
+    """
+    wavelet = pywt.ContinuousWavelet(wavelet) if isinstance(wavelet, str) else wavelet
+    data = np.asarray(data, dtype=np.float64)
+    length = len(data)
+    is_nan = np.isnan(data)
+    kernels = _cached_kernels(wavelet, scales)
+    n_fft = fft.next_fast_len(length + max(len(kernel) for kernel in kernels) - 1)
+    forward, inverse = (fft.fft, fft.ifft) if wavelet.complex_cwt else (fft.rfft, fft.irfft)
+    data_spectrum = forward(np.where(is_nan, 0, data), n=n_fft)
+    nan_cumsum = np.concatenate([[0], np.cumsum(is_nan)]) if is_nan.any() else None
+    for start in range(0, len(scales), chunk_size):
+        chunk = slice(start, min(start + chunk_size, len(scales)))
+        kernel_spectra = np.stack([forward(kernel, n=n_fft) for kernel in kernels[chunk]])
+        kernel_spectra *= data_spectrum
+        convolutions = inverse(kernel_spectra, n=n_fft, axis=1)
+        del kernel_spectra
+        coefficients = np.empty((chunk.stop - start, length),
+                                dtype=np.result_type(dtype, np.complex64) if wavelet.complex_cwt else dtype)
+        for row, (scale, kernel) in enumerate(zip(scales[chunk], kernels[chunk])):
+            convolution = convolutions[row, :length + len(kernel) - 1]
+            if nan_cumsum is not None:
+                convolution[_nan_windows(nan_cumsum, len(kernel))] = np.nan
+            coefficient = -np.sqrt(scale) * np.diff(convolution)
+            trim = (len(coefficient) - length) / 2
+            if trim < 0:
+                raise ValueError(f"Selected scale of {scale} too small.")
+            coefficients[row] = coefficient[floor(trim):len(coefficient) - ceil(trim)]
+        yield chunk, coefficients
+
+
+def cone_of_influence(length: int, wavelet="morl") -> np.ndarray:
+    """
+    Largest reliable period (in samples) per position: the power of a scale is affected by the edges within its
+    e-folding time sqrt(2) * scale (Torrence and Compo) from them
+    """
+    distance = np.minimum(np.arange(length), np.arange(length)[::-1]).astype(np.float64)
+    return distance / np.sqrt(2) / pywt.central_frequency(wavelet)
+
+
+def cwt_power(data, scales, wavelet="morl", chunk_size=32, out=None):
+    """
+    Wavelet power |pywt.cwt(data, scales, wavelet)[0]| ** 2 in float32, computed chunk by chunk so that only
+    chunk_size rows of complex coefficients exist at once
+    :param out: Array shaped (scales, n) to write the power into, e.g. a np.memmap for whole seasons
+    :return: The power, the frequencies of the scales (as pywt.cwt, per sample) and the cone of influence
+    """
+    scales = np.asarray(scales)
+    power = np.empty((len(scales), len(data)), dtype=np.float32) if out is None else out
+    for chunk, coefficients in iter_cwt_chunks(data, scales, wavelet, chunk_size, dtype=np.float64):
+        power[chunk] = np.abs(coefficients) ** 2
+    return power, pywt.scale2frequency(wavelet, scales, precision=10), cone_of_influence(len(data), wavelet)
+
+
+# Complex coefficients of recently transformed series by content, wavelet and scale set
+_TRANSFORM_CACHE = OrderedDict()
+_TRANSFORM_CACHE_SIZE = 8
+
+
+def wavelet_transform(data, scales, wavelet="cmor1.5-1.0", chunk_size=32, use_cache=True) -> np.ndarray:
+    """
+    Coefficients of iter_cwt_chunks as one complex64 array (scales, n). Series that were transformed before with
+    the same wavelet and scales are taken from the cache, so a series is transformed only once across all pairs.
+    :param use_cache: Keep the coefficients for later calls, off for series that are used once (e.g. red noise)
+    """
+    data = np.asarray(data, dtype=np.float64)
+    scales = np.asarray(scales)
+    key = (hashlib.sha1(data.tobytes()).hexdigest(), str(wavelet), tuple(scales.tolist()))
+    if use_cache and key in _TRANSFORM_CACHE:
+        _TRANSFORM_CACHE.move_to_end(key)
+        return _TRANSFORM_CACHE[key]
+    coefficients = np.empty((len(scales), len(data)), dtype=np.complex64)
+    for chunk, chunk_coefficients in iter_cwt_chunks(data, scales, wavelet, chunk_size, dtype=np.complex64):
+        coefficients[chunk] = chunk_coefficients
+    if use_cache:
+        _TRANSFORM_CACHE[key] = coefficients
+        if len(_TRANSFORM_CACHE) > _TRANSFORM_CACHE_SIZE:
+            _TRANSFORM_CACHE.popitem(last=False)
+    return coefficients
+
+
+def smooth_wavelet_spectrum(values: np.ndarray, scales, scale_window=0.6) -> np.ndarray:
+    """
+    Smoothing of Torrence and Webster for the coherence: in time a Gaussian with the width of the scale (as FFT
+    multiplication, zero padded), over scales a boxcar of scale_window octaves
+    """
+    scales = np.asarray(scales, dtype=np.float64)
+    length = values.shape[1]
+    n_fft = fft.next_fast_len(length + 2 * int(ceil(4 * scales.max())))
+    frequencies = fft.fftfreq(n_fft)
+    smoothed = np.empty(values.shape, dtype=np.result_type(values.dtype, np.complex64))
+    for start in range(0, len(scales), 32):
+        chunk = slice(start, min(start + 32, len(scales)))
+        gaussians = np.exp(-2 * np.pi ** 2 * scales[chunk, None] ** 2 * frequencies[None, :] ** 2)
+        smoothed[chunk] = fft.ifft(fft.fft(values[chunk], n=n_fft, axis=1) * gaussians, axis=1)[:, :length]
+    if not np.iscomplexobj(values):
+        smoothed = smoothed.real
+    # Mean over the scales within half the window (in octaves) on either side, by cumulative sums
+    octaves = np.log2(scales)
+    lower = np.searchsorted(octaves, octaves - scale_window / 2, side="left")
+    upper = np.searchsorted(octaves, octaves + scale_window / 2, side="right")
+    cumulative = np.concatenate([np.zeros((1, length), dtype=smoothed.dtype), np.cumsum(smoothed, axis=0)])
+    return (cumulative[upper] - cumulative[lower]) / (upper - lower)[:, None]
+
+
+def cross_wavelet(x, y, scales, wavelet="cmor1.5-1.0"):
+    """
+    Cross-wavelet power |W_x W_y*| and phase difference (radians, positive if x leads y) on a common index
+    :return: Cross-wavelet power and phase, both shaped (scales, n)
+    """
+    cross = wavelet_transform(x, scales, wavelet) * np.conj(wavelet_transform(y, scales, wavelet))
+    return np.abs(cross), np.angle(cross)
+
+
+def wavelet_coherence(x, y, scales, wavelet="cmor1.5-1.0", use_cache=True):
+    """
+    Squared wavelet coherence S(W_xy / s)|^2 / (S(|W_x|^2 / s) S(|W_y|^2 / s)) with the smoothing S of
+    smooth_wavelet_spectrum, in [0, 1]
+    :return: Coherence and phase difference of the smoothed cross spectrum, both shaped (scales, n)
+    """
+    scales = np.asarray(scales)
+    coefficients_x = wavelet_transform(x, scales, wavelet, use_cache=use_cache)
+    coefficients_y = wavelet_transform(y, scales, wavelet, use_cache=use_cache)
+    inverse_scales = (1 / scales)[:, None]
+    smoothed_x = smooth_wavelet_spectrum(np.abs(coefficients_x) ** 2 * inverse_scales, scales)
+    smoothed_y = smooth_wavelet_spectrum(np.abs(coefficients_y) ** 2 * inverse_scales, scales)
+    smoothed_cross = smooth_wavelet_spectrum(coefficients_x * np.conj(coefficients_y) * inverse_scales, scales)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        coherence = np.abs(smoothed_cross) ** 2 / (smoothed_x * smoothed_y)
+    return np.clip(coherence, 0, 1).astype(np.float32), np.angle(smoothed_cross).astype(np.float32)
+
+
+def _lag_one_autocorrelation(values: np.ndarray) -> float:
+    values = values[~np.isnan(values)]
+    return float(autocorrelation(values, 1)[0][1])
+
+
+def _red_noise_coherence_histograms(length, alphas, scales, wavelet, seed_sequence, n_surrogates, bins):
+    """Per scale histogram of the coherence of pairs of independent AR(1) series with the given coefficients"""
+    rng = np.random.default_rng(seed_sequence)
+    histograms = np.zeros((len(scales), len(bins) - 1), dtype=np.int64)
+    for _ in range(n_surrogates):
+        pair = [lfilter([1], [1, -alpha], rng.normal(size=length)) for alpha in alphas]
+        coherence, _ = wavelet_coherence(pair[0], pair[1], scales, wavelet, use_cache=False)
+        for row, values in enumerate(coherence):
+            histograms[row] += np.histogram(values[~np.isnan(values)], bins=bins)[0]
+    return histograms
+
+
+def red_noise_coherence_threshold(x, y, scales, wavelet="cmor1.5-1.0", n_surrogates=300, conf=0.95, seed=0,
+                                  n_workers=1, batch_size=10, n_bins=1000) -> np.ndarray:
+    """
+    Per scale significance level of the coherence: the conf quantile of the coherence of pairs of independent red
+    noise series (AR(1) with the lag one autocorrelation of x and y). Batches run on a process pool, every batch
+    draws from its own child of one SeedSequence and returns a histogram per scale (bin width 1 / n_bins).
+    :param n_workers: Number of processes for the batches, 1 computes them serially
+    """
+    scales = np.asarray(scales)
+    alphas = [_lag_one_autocorrelation(np.asarray(series, dtype=np.float64)) for series in (x, y)]
+    batch_sizes = [batch_size] * (n_surrogates // batch_size) + ([n_surrogates % batch_size] if n_surrogates %
+                                                                                                 batch_size else [])
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    bins = np.linspace(0, 1, n_bins + 1)
+    arguments = ([len(x)] * len(batch_sizes), [alphas] * len(batch_sizes), [scales] * len(batch_sizes),
+                 [wavelet] * len(batch_sizes), seed_sequences, batch_sizes, [bins] * len(batch_sizes))
+    if n_workers is None or n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            histograms = sum(executor.map(_red_noise_coherence_histograms, *arguments))
+    else:
+        histograms = sum(map(_red_noise_coherence_histograms, *arguments))
+    cumulative = np.cumsum(histograms, axis=1) / histograms.sum(axis=1, keepdims=True)
+    return bins[1:][np.argmax(cumulative >= conf, axis=1)]
@@ -2,16 +2,20 @@ import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import pywt
+from plotly.subplots import make_subplots
 
 from src.utils.data_loader import init_standard_data
 from src.utils.data_loader_speed import init_speed_data, spline_interpolation_of_speed_data
+from src.utils.filter_util import reduce_two_dfs_to_common_index
 from src.utils.project_constants import ProjectConstants
+from src.utils.wavelet_util import cross_wavelet, cwt_power, red_noise_coherence_threshold, wavelet_coherence
 
 
-def plot_make_wavelet_spectrum(series_with_datetime_index, scales, wavelet, title='Wavelet Power Spectrum'):
-    # Calculate the power spectrum
-    coefficients, freq = pywt.cwt(series_with_datetime_index, scales, wavelet)
-    power_spectrum = (np.abs(coefficients)) ** 2
+def plot_make_wavelet_spectrum(series_with_datetime_index, scales, wavelet, title='Wavelet Power Spectrum',
+                               show_coi=False):
+    """:param show_coi: Draw the cone of influence, the periods above it are affected by the edges"""
+    # Calculate the power spectrum (float32, chunked by scale)
+    power_spectrum, freq, coi = cwt_power(series_with_datetime_index, scales, wavelet)
 
     fig = go.Figure(data=go.Heatmap(
         z=power_spectrum,
@@ -21,6 +25,9 @@ def plot_make_wavelet_spectrum(series_with_datetime_index, scales, wavelet, titl
         colorbar=dict(title='Power')
     ))
 
+    if show_coi:
+        fig.add_trace(go.Scatter(x=series_with_datetime_index.index, y=np.minimum(coi, 1 / freq.min()) / 6,
+                                 mode='lines', line=dict(color='white', dash='dash'), name='Cone of Influence'))
     fig.update_layout(
         xaxis_title='Time',
         yaxis_title='Period [h]',
@@ -86,3 +93,49 @@ def plot_wavelet_spectrum_speed_supp():
     # Speed (nan filled with spline interpolation (edges with 0 padding) Wavelet Power Spectrum
     plot_make_wavelet_spectrum(spline_interpolation_of_speed_data(df_speed).fillna(0)["speed"], scales, wavelet,
                                "supp_figure_2b")
+
+
+def plot_wavelet_coherence_activity_speed(n_surrogates=300, n_workers=1):
+    """
+    Wavelet coherence of activity and speed on their common index with the 95% red noise significance contour, and
+    below it their cross-wavelet power and phase
+    """
+    df_act = init_standard_data(include_random_phases=True)
+    df_speed = init_speed_data(include_random_phases=True)
+    df_act, df_speed = reduce_two_dfs_to_common_index(df_act, df_speed)
+    # Complex morlet wavelets for the phase, same scales as the power spectra
+    wavelet = 'cmor1.5-1.0'
+    days = 2
+    scales = np.arange(1, 144 * days + 1)
+    coherence, phase = wavelet_coherence(df_act["activity"], df_speed["speed"], scales, wavelet)
+    cross_power, cross_phase = cross_wavelet(df_act["activity"], df_speed["speed"], scales, wavelet)
+    threshold = red_noise_coherence_threshold(df_act["activity"], df_speed["speed"], scales, wavelet,
+                                              n_surrogates=n_surrogates, n_workers=n_workers)
+    periods = 1 / pywt.scale2frequency(wavelet, scales) / 6
+
+    # Coherence with its significance, cross-wavelet power (log2) and the phase of activity relative to speed
+    fig = make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.03)
+    fig.add_trace(go.Heatmap(z=coherence, x=df_act.index, y=periods, zmin=0, zmax=1, colorscale='viridis',
+                             customdata=np.degrees(phase), colorbar=dict(title='Coherence', y=0.85, len=0.3),
+                             hovertemplate='%{x}<br>%{y:.1f}h<br>R²: %{z:.2f}<br>Phase: %{customdata:.0f}°'),
+                  row=1, col=1)
+    fig.add_trace(go.Contour(z=coherence / threshold[:, None], x=df_act.index, y=periods, showscale=False,
+                             contours=dict(start=1, end=1, coloring='lines'), line=dict(color='white', width=1),
+                             name='95% Significance'), row=1, col=1)
+    with np.errstate(divide="ignore"):
+        log_cross_power = np.log2(cross_power)
+    fig.add_trace(go.Heatmap(z=log_cross_power, x=df_act.index, y=periods, colorscale='viridis',
+                             colorbar=dict(title='log2 Power', y=0.5, len=0.3),
+                             hovertemplate='%{x}<br>%{y:.1f}h<br>log2 power: %{z:.2f}'), row=2, col=1)
+    fig.add_trace(go.Heatmap(z=np.degrees(cross_phase), x=df_act.index, y=periods, zmin=-180, zmax=180,
+                             colorscale='twilight', colorbar=dict(title='Phase [°]', y=0.15, len=0.3),
+                             hovertemplate='%{x}<br>%{y:.1f}h<br>Phase: %{z:.0f}°'), row=3, col=1)
+    for row in range(1, 4):
+        fig.update_yaxes(title_text='Period [h]', row=row, col=1)
+    fig.update_xaxes(title_text='Time', row=3, col=1)
+    fig.update_layout(showlegend=False)
+    fig.update_layout(width=1000, height=1000)
+    fig.update_layout(go.Layout(margin=go.layout.Margin(l=50, r=50, b=50, t=10)))
+    fig.update_layout(template="plotly_white")
+    fig.write_image(ProjectConstants.PLOTS.joinpath("wavelet_coherence_activity_speed").with_suffix(".pdf").as_posix())
+    fig.show()